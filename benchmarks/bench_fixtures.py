@@ -0,0 +1,112 @@
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import updater
+
+COMPETITIONS = ["League Two", "FA Cup", "Carabao Cup", "Bristol Street Motors Trophy"]
+OPPONENTS = ["Accrington Stanley", "Barrow", "Crewe Alexandra", "Notts County"]
+
+
+def make_fixture_list(n_seasons=20, games_per_season=50, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_seasons * games_per_season
+
+    game_dates = pd.Timestamp("2000-08-05") + pd.to_timedelta(
+        np.sort(rng.integers(0, n_seasons * 365, n)), unit="D"
+    )
+    ko_times = rng.choice(["15:00", "19:45", "12:30"], n)
+    competitions = rng.choice(COMPETITIONS, n)
+    opponents = rng.choice(OPPONENTS, n)
+    at_home = rng.random(n) < 0.5
+
+    suffix = " " * 19
+    home = np.where(at_home, "Tranmere Rovers", opponents)
+    away = np.where(at_home, opponents, "Tranmere Rovers")
+
+    df = pd.DataFrame(
+        {
+            "Competition": [
+                f"{comp} {comp} {date:%Y-%m-%d} {ko}"
+                for comp, date, ko in zip(competitions, game_dates, ko_times)
+            ],
+            "Home": [f"{team}{suffix}" for team in home],
+            "Away": [f"{team}{suffix}" for team in away],
+        }
+    )
+    df.columns = pd.MultiIndex.from_product([["Results"], df.columns])
+    return df
+
+
+def legacy_clean_fixtures(df):
+    df = df.copy()
+    df.columns = df.columns.droplevel(0)
+    col = df.Competition
+
+    df["date_time"] = pd.to_datetime(df.Competition.str[-16:]).dt.tz_localize(
+        "Europe/London"
+    )
+    df["end_time"] = df.date_time + pd.Timedelta(hours=2.25)
+
+    df["game_date"] = pd.to_datetime(
+        col.str.split(" ", expand=False).str[-2]
+    ).dt.tz_localize("Europe/London")
+    df["day"] = df.game_date.dt.day_name()
+    df["ko_time"] = col.str.split(" ", expand=False).str[-1]
+
+    df["competition"] = (
+        col.str.split(" ", expand=False)
+        .str[:-2]
+        .apply(lambda x: x[: len(x) // 2])
+        .str.join(" ")
+    )
+
+    df["venue"] = df.Home.apply(lambda x: "H" if "Tranmere" in x else "A")
+
+    df["opposition"] = df.apply(
+        lambda x: x.Away[:-19] if x.venue == "H" else x.Home[:-19], axis=1
+    )
+
+    return df[
+        [
+            "day",
+            "game_date",
+            "ko_time",
+            "opposition",
+            "venue",
+            "competition",
+            "date_time",
+            "end_time",
+        ]
+    ]
+
+
+def main(seasons=(1, 20, 100), repeat=5):
+    for n_seasons in seasons:
+        df = make_fixture_list(n_seasons)
+
+        expected = legacy_clean_fixtures(df)
+        actual = updater.clean_fixtures(df)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+        legacy = min(
+            timeit.repeat(lambda: legacy_clean_fixtures(df), number=1, repeat=repeat)
+        )
+        current = min(
+            timeit.repeat(lambda: updater.clean_fixtures(df), number=1, repeat=repeat)
+        )
+        print(
+            f"{n_seasons:>4} season(s), {len(df):>5} fixtures: "
+            f"legacy {legacy * 1000:8.1f} ms, "
+            f"vectorised {current * 1000:8.1f} ms "
+            f"({legacy / current:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,604 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import updater
+import replay
+from bench_fixtures import make_fixture_list
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+OPPONENTS = [
+    "Accrington Stanley",
+    "Barrow",
+    "Bromley",
+    "Crewe Alexandra",
+    "Gillingham",
+    "Notts County",
+    "Salford City",
+    "Walsall",
+]
+
+
+def shift_dates(col, days):
+    dates = pd.to_datetime(col) - pd.Timedelta(days=days)
+    return dates.dt.strftime("%Y-%m-%d")
+
+
+def get_seasons(dates):
+    dates = pd.to_datetime(dates)
+    start = dates.dt.year - (dates.dt.month < 8)
+    return start.astype(str) + "/" + (start + 1).astype(str).str[-2:]
+
+
+def scale_table(df_name, df, factor):
+    # Each copy of the history is moved back by a few days so every scaled
+    # table keeps realistic runs of dates without leaving pandas' date range.
+    copies = [df]
+    for k in range(1, factor):
+        copy = df.copy()
+        copy["game_date"] = shift_dates(copy.game_date, k)
+        if df_name == "results":
+            copy["season"] = get_seasons(copy.game_date)
+        copies.append(copy)
+    scaled = pd.concat(copies, ignore_index=True)
+    return scaled.sort_values("game_date", kind="mergesort")
+
+
+def make_scaled_data(src_dir, dst_dir, factor):
+    shutil.copytree(src_dir, dst_dir, ignore=shutil.ignore_patterns("parquet"))
+    rows = {}
+    for df_name in updater.TABLES:
+        path = f"{dst_dir}/{df_name}.csv"
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        if factor > 1:
+            df = scale_table(df_name, df, factor)
+            df.to_csv(path, index=False)
+        rows[df_name] = len(df)
+
+        # Appends need tables the updater has written itself.
+        storage = updater.csv_storage(dst_dir)
+        storage.save(df_name, storage.load(df_name))
+    return rows
+
+
+def make_player(name, shirt_no, status, substitutions=None, bookings=None):
+    return {
+        "name": {"full": name},
+        "meta": {"uniformNumber": shirt_no, "status": status},
+        "substitutions": substitutions or [],
+        "bookings": bookings,
+    }
+
+
+def make_team(name, outcome, score, scorers):
+    actions = [
+        {
+            "name": {"full": scorer},
+            "actions": [
+                {
+                    "type": "goal",
+                    "timeElapsed": minute,
+                    "penalty": False,
+                    "ownGoal": False,
+                }
+            ],
+        }
+        for scorer, minute in scorers
+    ]
+    return {
+        "name": {"full": name},
+        "eventOutcome": outcome,
+        "scores": {"score": score, "shootout": None, "aggregate": None},
+        "playerActions": actions,
+    }
+
+
+def make_event(date, opposition, goals_for, goals_against, rng):
+    scorers = [
+        (f"Player {rng.integers(2, 12)}", int(rng.integers(1, 91)))
+        for _ in range(goals_for)
+    ]
+    outcome = "home" if goals_for >= goals_against else "away"
+    return {
+        "eventKey": f"EFBO{date.replace('-', '')}",
+        "startTime": f"{date}T15:00:00+01:00",
+        "startTimeInUKHHMM": "15:00",
+        "eventType": "",
+        "eventProgress": "FULLTIME",
+        "eventStatus": "post-event",
+        "eventOutcomeType": None,
+        "venue": {"name": {"full": "Prenton Park"}},
+        "homeTeam": make_team("Tranmere Rovers", outcome, goals_for, scorers),
+        "awayTeam": make_team(opposition, outcome, goals_against, []),
+    }
+
+
+def make_match_list(events):
+    return {
+        "matchData": [
+            {
+                "tournamentMeta": {
+                    "tournamentName": {
+                        "first": "League Two",
+                        "full": "Sky Bet League Two",
+                    }
+                },
+                "tournamentDatesWithEvents": {
+                    date: [{"round": {"key": "x", "name": None}, "events": [event]}]
+                    for date, event in events.items()
+                },
+            }
+        ]
+    }
+
+
+def make_lineup(rng):
+    players = []
+    for shirt_no in range(1, 12):
+        substitutions, bookings = [], None
+        if shirt_no in (9, 10, 11):
+            substitutions = [
+                {
+                    "timeElapsed": int(rng.integers(46, 90)),
+                    "replacedBy": {
+                        "name": {"full": f"Player {shirt_no + 3}"},
+                        "meta": {"uniformNumber": shirt_no + 3},
+                    },
+                }
+            ]
+        if rng.random() < 0.2:
+            bookings = [
+                {"timeElapsed": int(rng.integers(1, 91)), "type": "yellow-card"}
+            ]
+        players.append(
+            make_player(
+                f"Player {shirt_no}", shirt_no, "starter", substitutions, bookings
+            )
+        )
+    for shirt_no in range(12, 19):
+        players.append(make_player(f"Player {shirt_no}", shirt_no, "bench"))
+
+    return {
+        "meta": {
+            "attendance": f"{int(rng.integers(4000, 12000)):,}",
+            "referee": "A Referee",
+        },
+        "teams": {
+            "homeTeam": {"players": players, "formation": 442},
+            "awayTeam": {"players": [], "formation": 433},
+        },
+    }
+
+
+def make_bbc_table():
+    header = "".join(
+        f"<th>{col}</th>"
+        for col in [
+            "Position",
+            "Team",
+            "Played",
+            "Won",
+            "Drawn",
+            "Lost",
+            "Goals For",
+            "Goals Against",
+            "Goal Difference",
+            "Points",
+        ]
+    )
+    teams = ["Tranmere Rovers"] + OPPONENTS + [f"Team {i}" for i in range(15)]
+    rows = "".join(
+        f"<tr><td>{pos}</td><td>{team}</td><td>40</td><td>15</td><td>10</td>"
+        f"<td>15</td><td>50</td><td>50</td><td>0</td><td>55</td></tr>"
+        for pos, team in enumerate(teams, start=1)
+    )
+    return (
+        f"<html><body><table><thead><tr>{header}</tr></thead>"
+        f"<tbody>{rows}</tbody></table></body></html>"
+    ).encode("utf-8")
+
+
+def put_response(store, url, content, content_type):
+    if not isinstance(content, bytes):
+        content = json.dumps(content).encode("utf-8")
+    store.put(
+        url, updater.http_response(url, content, 200, {"Content-Type": content_type})
+    )
+
+
+def make_recording(record_dir, data_dir, n_matches, seed=0):
+    rng = np.random.default_rng(seed)
+    store = updater.response_cache(record_dir)
+
+    last_date = pd.read_csv(
+        f"{data_dir}/results.csv", usecols=["game_date"]
+    ).game_date.max()
+    dates = [
+        (pd.Timestamp(last_date) + pd.Timedelta(days=7 * (i + 1))).strftime("%Y-%m-%d")
+        for i in range(n_matches)
+    ]
+
+    events = {}
+    for date in dates:
+        opposition = OPPONENTS[int(rng.integers(len(OPPONENTS)))]
+        goals_for, goals_against = (int(x) for x in rng.integers(0, 4, 2))
+        events[date] = make_event(date, opposition, goals_for, goals_against, rng)
+        put_response(
+            store,
+            f"https://push.api.bbci.co.uk/data/bbc-morph-sport-football-team-lineups-data/event/{events[date]['eventKey']}/version/1.0.8",
+            make_lineup(rng),
+            "application/json",
+        )
+
+    # Range requests are chunked by calendar, backfill asks around its dates.
+    chunks = set(updater.get_date_chunks(dates[0], dates[-1]))
+    for chunk_start, chunk_end in sorted(chunks | set(updater.get_date_spans(dates))):
+        chunk = {
+            date: event
+            for date, event in events.items()
+            if chunk_start <= date <= chunk_end
+        }
+        put_response(
+            store,
+            updater.get_match_list_url(chunk_start, chunk_end),
+            make_match_list(chunk),
+            "application/json",
+        )
+
+    put_response(
+        store,
+        "https://www.bbc.com/sport/football/league-two/table",
+        make_bbc_table(),
+        "text/html",
+    )
+
+    with open(f"{data_dir}/managers.csv", "rb") as f:
+        managers = f.read().rstrip()
+    managers += f"\nA Manager,{dates[0]},2099-12-31,Manager\n".encode("utf-8")
+    put_response(store, updater.MANAGERS_URL, managers, "text/csv")
+
+    return f"{dates[0]}..{dates[-1]}"
+
+
+def get_digest(path, size):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read(size)).hexdigest()
+
+
+def get_file_states(root):
+    states = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            stat = os.stat(path)
+            states[path] = (stat.st_size, stat.st_mtime_ns, get_digest(path, None))
+    return states
+
+
+def is_appended(path, before, after):
+    # A file that grew with its old contents intact was appended to.
+    old_size, _, old_digest = before[path]
+    return after[path][0] > old_size and get_digest(path, old_size) == old_digest
+
+
+def get_changed(before, after):
+    return [
+        path
+        for path, state in after.items()
+        if before.get(path, (None, None, None))[:2] != state[:2]
+    ]
+
+
+def get_bytes_written(before, after):
+    written = 0
+    for path in get_changed(before, after):
+        if path in before and is_appended(path, before, after):
+            written += after[path][0] - before[path][0]
+        else:
+            written += after[path][0]
+    return written
+
+
+def is_table_file(path, df_name):
+    # The table's CSV plus any derived copy such as the parquet parts.
+    name = os.path.basename(path).split(".")[0]
+    return df_name in [name, os.path.basename(os.path.dirname(path))]
+
+
+def get_bytes_rewritten(before, after, df_name):
+    return sum(
+        after[path][0]
+        for path in get_changed(before, after)
+        if path in before
+        and is_table_file(path, df_name)
+        and not is_appended(path, before, after)
+    )
+
+
+class pipeline_bench:
+    def __init__(self, data_dir, record_dir, date_req, server, factor):
+        self.data_dir = data_dir
+        self.record_dir = record_dir
+        self.date_req = date_req
+        self.server = server
+        self.factor = factor
+        self.n_results = len(pd.read_csv(f"{data_dir}/results.csv", usecols=[0]))
+
+    def get_client(self):
+        return updater.http_client(
+            limiter=updater.rate_limiter(intervals={}, default_interval=0),
+            replay_url=self.server.url,
+        )
+
+    def get_match_lists(self):
+        start_date, end_date = self.date_req.split("..")
+        return updater.get_match_lists(start_date, end_date)
+
+    def get_updates(self):
+        staged = updater.staged_updates()
+        match_lists = self.get_match_lists()
+        for records in updater.backfill(
+            sorted(match_lists), "bbc", match_lists=match_lists
+        ):
+            staged.add_records(records)
+        return {df_name: staged.get_updates(df_name) for df_name in updater.TABLES}
+
+    def prepare_clean_df(self):
+        n_seasons = math.ceil(self.n_results / 50)
+        df = make_fixture_list(n_seasons)
+        return lambda: updater.clean_fixtures(df)
+
+    def prepare_events_df(self):
+        matches = [
+            updater.bbc_api(date, match_list=match_list)
+            for date, match_list in self.get_match_lists().items()
+        ]
+        for match in matches:
+            match.lineup_data
+
+        def run():
+            for match in matches:
+                events = updater.events_df(match.date, match)
+                for df_name in updater.EVENT_TABLES:
+                    getattr(events, df_name)
+
+        return run
+
+    def prepare_archive_csv(self, df_name):
+        return lambda: updater.archive_csv(df_name)
+
+    def prepare_update_csv(self, df_name):
+        updates = self.get_updates()[df_name]
+        old_df = updater.storage.load(df_name)
+        return lambda: updater.update_csv(df_name, old_df, updates.copy())
+
+    def prepare_update_csv_rebuild(self, df_name):
+        updates = self.get_updates()[df_name].copy()
+        old_df = updater.storage.load(df_name)
+        # Moving the new rows into the middle of the history forces the
+        # out-of-order path that rewrites the whole table.
+        updates["game_date"] = pd.to_datetime(updates.game_date) - pd.DateOffset(
+            years=50
+        )
+        return lambda: updater.update_csv(df_name, old_df, updates.copy())
+
+    def prepare_update_df(self, df_name):
+        updates = self.get_updates()[df_name]
+        return lambda: updater.update_df(df_name, updates.copy())
+
+    def prepare_main(self):
+        return lambda: updater.main("bbc", self.date_req)
+
+    def get_stages(self):
+        stages = [
+            ("fixtures.clean_df", None, self.prepare_clean_df),
+            ("events_df", None, self.prepare_events_df),
+        ]
+        for df_name in ["results", "player_apps"]:
+            stages += [
+                ("archive_csv", df_name, lambda d=df_name: self.prepare_archive_csv(d)),
+                ("update_csv", df_name, lambda d=df_name: self.prepare_update_csv(d)),
+                (
+                    "update_csv_rebuild",
+                    df_name,
+                    lambda d=df_name: self.prepare_update_csv_rebuild(d),
+                ),
+                ("update_df", df_name, lambda d=df_name: self.prepare_update_df(d)),
+            ]
+        stages.append(("main", None, self.prepare_main))
+        return stages
+
+    def setup(self, prepare):
+        run_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+        shutil.copytree(self.data_dir, f"{run_dir}/data")
+        os.chdir(run_dir)
+        updater.default_client = self.get_client()
+        updater.memo.clear()
+        return run_dir, prepare()
+
+    def measure(self, prepare, repeat, df_name=None):
+        seconds = []
+        for _ in range(repeat):
+            run_dir, run = self.setup(prepare)
+            before = get_file_states(run_dir)
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+            after = get_file_states(run_dir)
+            bytes_written = get_bytes_written(before, after)
+            bytes_rewritten = get_bytes_rewritten(before, after, df_name)
+            shutil.rmtree(run_dir)
+
+        run_dir, run = self.setup(prepare)
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        shutil.rmtree(run_dir)
+
+        return {
+            "seconds": min(seconds),
+            "peak_bytes": peak,
+            "bytes_written": bytes_written,
+            "bytes_rewritten": bytes_rewritten,
+        }
+
+    def run(self, repeat=1, stage_names=None):
+        results = []
+        for stage, df_name, prepare in self.get_stages():
+            if stage_names and stage not in stage_names:
+                continue
+            result = {"scale": self.factor, "stage": stage, "table": df_name}
+            result.update(self.measure(prepare, repeat, df_name))
+            results.append(result)
+            print_result(result, file=sys.__stdout__)
+        return results
+
+
+def get_name(result):
+    if result["table"]:
+        return f"{result['stage']} [{result['table']}]"
+    return result["stage"]
+
+
+def print_result(result, file=None):
+    print(
+        f"{result['scale']:>4}x {get_name(result):<34} "
+        f"{result['seconds'] * 1000:10.1f} ms "
+        f"{result['peak_bytes'] / 2**20:9.1f} MiB peak "
+        f"{result['bytes_written'] / 2**20:9.1f} MiB written",
+        file=file,
+    )
+
+
+def get_key(result):
+    return result["scale"], result["stage"], result["table"]
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = {get_key(result): result for result in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(get_key(result))
+        if previous is None:
+            continue
+        for metric in ["seconds", "peak_bytes", "bytes_written"]:
+            if previous[metric] and result[metric] > previous[metric] * threshold:
+                regressions.append((result, metric, previous[metric]))
+
+    for result, metric, previous in regressions:
+        print(
+            f"REGRESSION {result['scale']}x {get_name(result)} "
+            f"{metric}: {previous:.4g} -> {result[metric]:.4g}"
+        )
+    return regressions
+
+
+def check_appends(results):
+    # An append that rewrites the table's existing files costs as much as a
+    # rebuild, which a baseline recorded after the same mistake would hide.
+    rewrites = [
+        result
+        for result in results
+        if result["stage"] == "update_csv" and result["bytes_rewritten"]
+    ]
+    for result in rewrites:
+        print(
+            f"REWRITE {result['scale']}x {get_name(result)} rewrote "
+            f"{result['bytes_rewritten']:.4g} bytes of existing files"
+        )
+    return rewrites
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the updater pipeline.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--matches", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--stages", nargs="+")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    parser.add_argument("--threshold", type=float, default=1.5)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    src_dir = os.path.join(REPO_DIR, "data")
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    cwd = os.getcwd()
+
+    results = []
+    try:
+        record_dir = f"{work_dir}/recording"
+        date_req = make_recording(record_dir, src_dir, args.matches)
+        server = replay.start_server(record_dir, latency=args.latency)
+
+        for factor in args.scales:
+            data_dir = f"{work_dir}/data_{factor}x"
+            rows = make_scaled_data(src_dir, data_dir, factor)
+            print(
+                f"{factor}x: {rows['results']} results, "
+                f"{rows['player_apps']} player_apps rows"
+            )
+            bench = pipeline_bench(data_dir, record_dir, date_req, server, factor)
+            if args.verbose:
+                results += bench.run(args.repeat, args.stages)
+            else:
+                with open(os.devnull, "w") as devnull:
+                    sys.stdout = devnull
+                    try:
+                        results += bench.run(args.repeat, args.stages)
+                    finally:
+                        sys.stdout = sys.__stdout__
+
+        server.shutdown()
+        server.server_close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "pandas": pd.__version__,
+                "matches": args.matches,
+                "results": results,
+            },
+            f,
+            indent=1,
+        )
+    print(f"Results saved to {output}")
+
+    failed = check_appends(results)
+    if args.compare and compare(results, args.compare, args.threshold):
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
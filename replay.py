@@ -0,0 +1,157 @@
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from updater import response_cache
+
+
+class replay_handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def get_original_url(self):
+        host, _, path = self.path.lstrip("/").partition("/")
+        return f"https://{host}/{path}"
+
+    def send_body(self, status_code, body, content_type=None, etag=None):
+        self.send_response(status_code)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = self.get_original_url()
+        server.count("requests")
+
+        delay = server.latency + server.rng.uniform(0, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if server.rng.random() < server.drop_rate:
+            server.count("dropped")
+            self.close_connection = True
+            return
+
+        if server.rng.random() < server.failure_rate:
+            server.count("failed")
+            self.send_body(server.failure_status, b"Injected failure")
+            return
+
+        meta, body = server.store.get(url)
+        if meta is None:
+            server.count("missing")
+            print(f"No recording for {url}")
+            self.send_body(404, f"No recording for {url}".encode("utf-8"))
+            return
+
+        etag = meta.get("etag")
+        if etag and self.headers.get("If-None-Match") == etag:
+            server.count("not_modified")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        server.count("served")
+        self.send_body(
+            meta.get("status_code", 200), body, meta.get("content_type"), etag
+        )
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class replay_server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        record_dir,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        jitter=0.0,
+        failure_rate=0.0,
+        failure_status=503,
+        drop_rate=0.0,
+        seed=None,
+        verbose=False,
+    ):
+        super().__init__((host, port), replay_handler)
+        self.store = response_cache(record_dir)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.drop_rate = drop_rate
+        self.rng = random.Random(seed)
+        self.verbose = verbose
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+def start_server(record_dir, **kwargs):
+    server = replay_server(record_dir, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve recorded responses as a stand-in for the scraped sites."
+    )
+    parser.add_argument("record_dir")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-status", type=int, default=503)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = replay_server(
+        args.record_dir,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+        verbose=args.verbose,
+    )
+    print(f"Replaying {args.record_dir} on {server.url}")
+    print(f"Run the updater with UPDATER_REPLAY_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(server.counts)
+
+
+if __name__ == "__main__":
+    main()
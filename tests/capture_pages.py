@@ -0,0 +1,36 @@
+import os
+import sys
+
+# Records the live pages read_table parses, through the updater's own record
+# mode, for the recorded-page tests in test_read_table.py:
+#
+#     python tests/capture_pages.py
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+RECORDED_DIR = os.path.join(TESTS_DIR, "fixtures", "recorded")
+os.environ["UPDATER_RECORD_DIR"] = RECORDED_DIR
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import pandas as pd
+
+import updater
+
+
+def get_last_league_date():
+    results = pd.read_csv(
+        os.path.join(os.path.dirname(TESTS_DIR), "data", "results.csv"),
+        usecols=["game_date", "game_type"],
+    )
+    return results[results.game_type == "League"].game_date.max()
+
+
+def main():
+    date = get_last_league_date()
+    updater.fixtures()
+    updater.league_table(date, "11v11")
+    updater.league_table(date, "bbc")
+    print(f"Pages recorded in {RECORDED_DIR}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+
+import pandas as pd
+import pytest
+
+import updater
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(updater, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(updater, "storage", updater.csv_storage(f"{REPO_DIR}/data"))
+    return tmp_path / "archive"
+
+
+def test_list_snapshots_skips_manifest(archive_dir):
+    updater.archive_csv("red_cards", "2026-04-11-120000")
+    updater.archive_csv("red_cards", "2026-04-18-120000")
+    legacy_dir = archive_dir / "2026-04-06-120000"
+    legacy_dir.mkdir()
+    (legacy_dir / "red_cards.csv").write_bytes(updater.storage.read_bytes("red_cards"))
+
+    assert (archive_dir / "manifest.json").exists()
+    timestamps = updater.list_snapshots()
+    assert timestamps == [
+        "2026-04-06-120000",
+        "2026-04-11-120000",
+        "2026-04-18-120000",
+    ]
+    expected = pd.read_csv(f"{REPO_DIR}/data/red_cards.csv", parse_dates=["game_date"])
+    for timestamp in timestamps:
+        pd.testing.assert_frame_equal(updater.restore(timestamp, "red_cards"), expected)
+
+
+def test_migrate_archive_command(archive_dir):
+    legacy_dir = archive_dir / "2026-04-06-120000"
+    legacy_dir.mkdir(parents=True)
+    data = updater.storage.read_bytes("red_cards")
+    (legacy_dir / "red_cards.csv").write_bytes(data)
+
+    updater.cli(["migrate-archive"])
+    assert not legacy_dir.exists()
+    assert updater.list_snapshots() == ["2026-04-06-120000"]
+    assert updater.restore_bytes("2026-04-06-120000", "red_cards") == data
@@ -0,0 +1,55 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import updater
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    shutil.copy(f"{REPO_DIR}/data/goals.csv", tmp_path)
+    storage = updater.csv_storage(str(tmp_path))
+    monkeypatch.setattr(updater, "storage", storage)
+    return storage
+
+
+def make_goals(date):
+    return pd.DataFrame(
+        {
+            "game_date": [date],
+            "player_name": ["X Y"],
+            "goal_min": [44],
+            "penalty": [0],
+            "own_goal": [0],
+        }
+    )
+
+
+def test_legacy_table_is_rebuilt_before_appending(storage):
+    old_df = storage.load("goals")
+    assert not storage.is_canonical("goals", old_df)
+
+    updated_df = updater.update_csv("goals", old_df, make_goals("2026-05-02"))
+    assert storage.is_canonical("goals", updated_df)
+    with open(storage.get_path("goals"), "rb") as f:
+        data = f.read()
+    assert data == updater.serialize_csv("goals", updated_df)
+    assert b".0," not in data
+
+    updater.update_csv("goals", updated_df, make_goals("2026-05-09"))
+    assert storage.is_canonical("goals", storage.load("goals"))
+    with open(storage.get_path("goals"), "rb") as f:
+        assert f.read() == data + b"2026-05-09,X Y,44,0,0\n"
+
+
+def test_edited_table_is_no_longer_canonical(storage):
+    storage.save("goals", storage.load("goals"))
+    assert storage.is_canonical("goals", storage.load("goals"))
+
+    with open(storage.get_path("goals"), "ab") as f:
+        f.write(b"2026-05-02,X Y,44.0,0.0,0.0\n")
+    assert not storage.is_canonical("goals", storage.load("goals"))
@@ -0,0 +1,70 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import updater
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGE = (Path(__file__).parent / "fixtures" / "soccerbase_results.html").read_bytes()
+
+
+class page_response:
+    status_code = 200
+    content = PAGE
+
+
+class page_client:
+    def get(self, url, ttl=None):
+        return page_response()
+
+
+@pytest.fixture
+def calendar(tmp_path, monkeypatch):
+    monkeypatch.setattr(updater, "storage", updater.csv_storage(f"{REPO_DIR}/data"))
+    return updater.fixture_calendar(
+        path=str(tmp_path / "data" / "fixture_calendar.csv"),
+        state_path=str(tmp_path / "cache" / "fixture_calendar.json"),
+    )
+
+
+def test_only_scraped_rows_are_stored(calendar):
+    calendar.refresh(page_client())
+
+    stored = pd.read_csv(calendar.path)
+    assert len(stored) == 6
+    assert "scraped_at" not in stored
+    assert not calendar.is_stale()
+
+    reloaded = updater.fixture_calendar(calendar.path, state_path=calendar.state_path)
+    assert set(reloaded.df.source) == {"results", "soccerbase"}
+    pd.testing.assert_frame_equal(reloaded.df, calendar.df)
+
+
+def test_unchanged_fixtures_are_not_rewritten(calendar):
+    calendar.refresh(page_client())
+    with open(calendar.path, "rb") as f:
+        data = f.read()
+    mtime = os.stat(calendar.path).st_mtime_ns
+
+    calendar.refresh(page_client())
+    assert os.stat(calendar.path).st_mtime_ns == mtime
+    with open(calendar.path, "rb") as f:
+        assert f.read() == data
+
+
+def test_legacy_calendar_keeps_scraped_rows(calendar):
+    calendar.refresh(page_client())
+    legacy = pd.concat(
+        [
+            calendar.get_results_fixtures().assign(scraped_at=None),
+            pd.read_csv(calendar.path).assign(
+                source="soccerbase", scraped_at="2026-04-11T09:00:00+01:00"
+            ),
+        ]
+    )
+    legacy.to_csv(calendar.path, index=False)
+
+    reloaded = updater.fixture_calendar(calendar.path, state_path=calendar.state_path)
+    pd.testing.assert_frame_equal(reloaded.scraped, calendar.scraped)
@@ -0,0 +1,82 @@
+import pandas as pd
+
+import updater
+
+
+class empty_response:
+    status_code = 200
+
+    def json(self):
+        return {"matchData": []}
+
+
+class counting_client:
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, ttl=None):
+        self.urls.append(url)
+        return empty_response()
+
+
+def test_date_spans_cover_only_requested_dates():
+    dates = ["2025-12-20", "2025-08-09", "2025-08-16", "2026-04-11", "2025-09-13"]
+    assert updater.get_date_spans(dates) == [
+        ("2025-08-09", "2025-08-16"),
+        ("2025-09-13", "2025-09-13"),
+        ("2025-12-20", "2025-12-20"),
+        ("2026-04-11", "2026-04-11"),
+    ]
+
+
+def test_date_spans_are_capped():
+    dates = pd.date_range("2025-08-01", "2025-10-31", freq="7D").strftime("%Y-%m-%d")
+    spans = updater.get_date_spans(dates)
+    for start, end in spans:
+        days = (pd.Timestamp(end) - pd.Timestamp(start)).days
+        assert days < updater.MATCH_LIST_CHUNK_DAYS
+    assert spans[0][0] == dates[0]
+    assert spans[-1][1] == dates[-1]
+
+
+def test_sparse_dates_fetch_one_request_each():
+    updater.memo.clear()
+    client = counting_client()
+    updater.get_match_lists_for(["2022-08-06", "2025-03-01"], client)
+    assert client.urls == [
+        updater.get_match_list_url("2022-08-06", "2022-08-06"),
+        updater.get_match_list_url("2025-03-01", "2025-03-01"),
+    ]
+
+
+def test_range_is_fetched_once(monkeypatch):
+    updater.memo.clear()
+    client = counting_client()
+    monkeypatch.setattr(updater, "default_client", client)
+
+    dates = "2026-04-13..2026-06-01"
+    assert updater.check_dates(dates, existing_dates=set()) == []
+    updater.get_range_match_lists(dates)
+    assert client.urls == [
+        updater.get_match_list_url(start, end)
+        for start, end in updater.get_date_chunks("2026-04-13", "2026-06-01")
+    ]
+
+
+def test_backfill_uses_given_match_lists(monkeypatch):
+    def fail(dates, client=None):
+        raise AssertionError("match lists fetched again")
+
+    def get_match_records(date, table_source, match_list=None, manager=None):
+        return {"date": date, "match_list": match_list}
+
+    monkeypatch.setattr(updater, "get_match_lists_for", fail)
+    monkeypatch.setattr(updater, "get_managers", lambda dates: [None] * len(dates))
+    monkeypatch.setattr(updater, "get_match_records", get_match_records)
+
+    match_lists = {"2026-04-18": {"matchData": []}}
+    records = updater.backfill(["2026-04-18", "2026-05-02"], "bbc", 1, match_lists)
+    assert sorted((r["date"], r["match_list"]) for r in records) == [
+        ("2026-04-18", {"matchData": []}),
+        ("2026-05-02", None),
+    ]
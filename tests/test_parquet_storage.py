@@ -0,0 +1,60 @@
+import os
+
+import pandas as pd
+import pytest
+
+import updater
+
+pytest.importorskip("pyarrow")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def goals():
+    return updater.csv_storage(f"{REPO_DIR}/data").load("goals")
+
+
+def test_append_adds_parts(tmp_path, goals):
+    storage = updater.parquet_storage(str(tmp_path))
+    storage.save("goals", goals[:100])
+    for end in [110, 120, 130]:
+        storage.append("goals", goals[end - 10 : end], goals[:end])
+
+    assert len(storage.list_parts("goals")) == 4
+    assert storage.is_fresh("goals")
+    pd.testing.assert_frame_equal(
+        storage.load("goals"),
+        updater.csv_storage(str(tmp_path)).load("goals"),
+        check_categorical=False,
+    )
+
+
+def test_append_compacts_parts(tmp_path, goals):
+    storage = updater.parquet_storage(str(tmp_path))
+    storage.save("goals", goals[:100])
+    end = 100
+    for _ in range(updater.COLUMNAR_MAX_PARTS):
+        end += 5
+        storage.append("goals", goals[end - 5 : end], goals[:end])
+
+    assert len(storage.list_parts("goals")) < updater.COLUMNAR_MAX_PARTS
+    pd.testing.assert_frame_equal(
+        storage.load("goals"),
+        goals[:end].reset_index(drop=True),
+        check_categorical=False,
+    )
+
+
+def test_stale_copy_is_rewritten(tmp_path, goals):
+    storage = updater.parquet_storage(str(tmp_path))
+    storage.save("goals", goals[:100])
+    updater.csv_storage(str(tmp_path)).append("goals", goals[100:110], goals[:110])
+    storage.append("goals", goals[110:120], goals[:120])
+
+    assert len(storage.list_parts("goals")) == 1
+    pd.testing.assert_frame_equal(
+        storage.load("goals"),
+        goals[:120].reset_index(drop=True),
+        check_categorical=False,
+    )
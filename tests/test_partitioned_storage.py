@@ -0,0 +1,64 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import updater
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The first game of 2022/23, played before August.
+EARLY_START = "2022-07-30"
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for df_name in ["results", "goals"]:
+        shutil.copy(f"{REPO_DIR}/data/{df_name}.csv", tmp_path)
+    updater.migrate_storage(str(tmp_path))
+    return str(tmp_path)
+
+
+def read_partition(storage, df_name, partition):
+    with open(storage.get_partition_path(df_name, partition), "rb") as f:
+        return f.read()
+
+
+def test_partitions_follow_season(data_dir):
+    storage = updater.partitioned_storage(data_dir)
+    for df_name in ["results", "goals"]:
+        assert EARLY_START.encode() in read_partition(storage, df_name, "2022-23")
+        assert EARLY_START.encode() not in read_partition(storage, df_name, "2021-22")
+
+
+def test_read_bytes_matches_flat_file(data_dir):
+    storage = updater.partitioned_storage(data_dir)
+    for df_name in ["results", "goals"]:
+        flat = updater.csv_storage(f"{REPO_DIR}/data").load(df_name)
+        data = storage.read_bytes(df_name)
+        assert data == updater.serialize_csv(df_name, flat)
+        assert data.endswith(b"\n")
+
+
+def test_load_for_update_sees_whole_season(data_dir):
+    storage = updater.partitioned_storage(data_dir)
+    updates = pd.DataFrame({"game_date": pd.to_datetime(["2022-08-06"])})
+    goals = storage.load_for_update("goals", updates)
+    assert EARLY_START in set(goals.game_date.dt.strftime(updater.DATE_FORMAT))
+
+
+def test_migrate_moves_rows_filed_by_date(data_dir):
+    storage = updater.partitioned_storage(data_dir)
+    results = storage.load("results")
+    early = results.game_date == EARLY_START
+    storage.write_partition(
+        "results", "2021-22", results[(results.season == "2021/22") | early]
+    )
+    storage.write_partition(
+        "results", "2022-23", results[results.season == "2022/23"][1:]
+    )
+
+    updater.migrate_storage(data_dir)
+    assert EARLY_START.encode() in read_partition(storage, "results", "2022-23")
+    pd.testing.assert_frame_equal(storage.load("results"), results)
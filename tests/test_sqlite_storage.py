@@ -0,0 +1,152 @@
+import os
+import shutil
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import updater
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABLES = ["results", "sub_mins", "yellow_cards", "red_cards"]
+
+# A stored match with a red card and two yellows.
+REFETCHED = "2026-03-03"
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("data")
+    for df_name in TABLES:
+        shutil.copy(f"{REPO_DIR}/data/{df_name}.csv", "data")
+    updater.migrate_to_sqlite("data")
+    return str(tmp_path / "data")
+
+
+@pytest.fixture
+def db(data_dir, monkeypatch):
+    db = updater.sqlite_storage(data_dir)
+    monkeypatch.setattr(updater, "storage", db)
+    yield db
+    db.conn.close()
+
+
+def load_flat(df_name):
+    df = updater.csv_storage(f"{REPO_DIR}/data").load(df_name)
+    df = df.sort_values(updater.SORT_COLS[df_name], kind="mergesort")
+    return updater.apply_schema(df_name, df.reset_index(drop=True))
+
+
+def get_rows(db, df_name, date):
+    df = db.query(df_name, "WHERE game_date = ?", [date])
+    return df.drop(columns="game_date").astype(object).values.tolist()
+
+
+def test_migrate_round_trip(data_dir, db):
+    for df_name in TABLES:
+        assert not os.path.exists(f"{data_dir}/{df_name}.csv")
+        flat = load_flat(df_name)
+        pd.testing.assert_frame_equal(db.load(df_name), flat)
+        assert db.read_bytes(df_name) == updater.serialize_csv(df_name, flat)
+
+
+def test_upsert_keeps_repeated_players(db):
+    sub_mins = pd.DataFrame(
+        {
+            "game_date": pd.to_datetime(["2026-05-02"] * 3),
+            "player_name": ["Sub One", "Player 9", "Sub One"],
+            "min_off": [None, 46, 80],
+            "min_on": [46, None, None],
+        }
+    )
+    yellow_cards = pd.DataFrame(
+        {
+            "game_date": pd.to_datetime(["2026-05-02"] * 2),
+            "player_name": ["Player 4", "Player 4"],
+            "min_yc": [30, 75],
+        }
+    )
+    with db.transaction():
+        db.save("sub_mins", sub_mins)
+        db.save("yellow_cards", yellow_cards)
+
+    assert get_rows(db, "sub_mins", "2026-05-02") == [
+        ["Sub One", pd.NA, 46],
+        ["Player 9", 46, pd.NA],
+        ["Sub One", 80, pd.NA],
+    ]
+    assert get_rows(db, "yellow_cards", "2026-05-02") == [
+        ["Player 4", 30],
+        ["Player 4", 75],
+    ]
+
+
+def test_refresh_replaces_stored_rows(db, monkeypatch):
+    results = db.query("results", "WHERE game_date = ?", [REFETCHED])
+    results["attendance"] = 4321
+    records = {
+        "results": results,
+        "yellow_cards": pd.DataFrame(
+            {
+                "game_date": pd.to_datetime([REFETCHED]),
+                "player_name": ["Sam Finley"],
+                "min_yc": [22],
+            }
+        ),
+    }
+    monkeypatch.setattr(updater, "check_dates", lambda dates, **kwargs: [REFETCHED])
+    monkeypatch.setattr(updater, "backfill", lambda *args, **kwargs: [records])
+    n_results = len(db.load("results"))
+
+    updater.main("bbc", REFETCHED, refresh=True)
+    refetched = db.query("results", "WHERE game_date = ?", [REFETCHED])
+    assert list(refetched.attendance) == [4321]
+    assert len(db.load("results")) == n_results
+    assert get_rows(db, "yellow_cards", REFETCHED) == [["Sam Finley", 22]]
+    assert get_rows(db, "red_cards", REFETCHED) == []
+
+    other = db.query("red_cards", "WHERE game_date <> ?", [REFETCHED])
+    flat = load_flat("red_cards")
+    pd.testing.assert_frame_equal(other, flat[flat.game_date != REFETCHED])
+
+
+def test_old_keys_are_rebuilt(tmp_path):
+    path = tmp_path / updater.DB_NAME
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE sub_mins (game_date TEXT, player_name TEXT, "
+        "min_off INTEGER, min_on INTEGER, PRIMARY KEY (game_date, player_name))"
+    )
+    conn.executemany(
+        "INSERT INTO sub_mins VALUES (?, ?, ?, ?)",
+        [("2026-04-11", "Sub One", None, 60), ("2026-04-11", "Player 11", 60, None)],
+    )
+    conn.commit()
+    conn.close()
+
+    db = updater.sqlite_storage(str(tmp_path))
+    sql = db.conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'sub_mins'"
+    ).fetchone()[0]
+    assert sql == db.get_table_sql("sub_mins")
+    assert get_rows(db, "sub_mins", "2026-04-11") == [
+        ["Sub One", pd.NA, 60],
+        ["Player 11", 60, pd.NA],
+    ]
+
+    sub_mins = pd.DataFrame(
+        {
+            "game_date": pd.to_datetime(["2026-04-11"] * 3),
+            "player_name": ["Sub One", "Player 11", "Sub One"],
+            "min_off": [None, 60, 85],
+            "min_on": [60, None, None],
+        }
+    )
+    db.save("sub_mins", sub_mins)
+    assert len(db.load("sub_mins")) == 3
+    db.conn.close()
+
+    reopened = updater.sqlite_storage(str(tmp_path))
+    assert len(reopened.load("sub_mins")) == 3
+    reopened.conn.close()
@@ -1,7 +1,107 @@
-import pandas as pd
-import requests
 import re
 import os
+import io
+import csv
+import gzip
+import hashlib
+import json
+import argparse
+import importlib
+import importlib.util
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from functools import cached_property, wraps
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+
+class lazy_module:
+    def __init__(self, module_name):
+        self.module_name = module_name
+        self.module = None
+
+    def __getattr__(self, attr):
+        if self.module is None:
+            self.module = importlib.import_module(self.module_name)
+        return getattr(self.module, attr)
+
+
+# Deferred so that a run with nothing to do never pays for these imports.
+np = lazy_module("numpy")
+pd = lazy_module("pandas")
+requests = lazy_module("requests")
+
+MAX_WORKERS = 4
+
+DATA_DIR = "./data"
+DATE_FORMAT = "%Y-%m-%d"
+DB_NAME = "tables.db"
+COLUMNAR_MAX_PARTS = 16
+ARCHIVE_DIR = "./archive"
+CACHE_DIR = "./cache/http"
+CALENDAR_STATE_PATH = "./cache/fixture_calendar.json"
+EXPORT_DIR = "./export"
+STORAGE = os.environ.get("UPDATER_STORAGE")
+RECORD_DIR = os.environ.get("UPDATER_RECORD_DIR")
+REPLAY_URL = os.environ.get("UPDATER_REPLAY_URL")
+CALENDAR_PATH = f"{DATA_DIR}/fixture_calendar.csv"
+CALENDAR_MAX_AGE = 12 * 60 * 60
+UK_TZ = ZoneInfo("Europe/London")
+REPORT_PATH = "./reports/runs.jsonl"
+
+HOST_TIMEOUTS = {
+    "push.api.bbci.co.uk": (5, 15),
+    "www.bbc.com": (5, 30),
+    "www.11v11.com": (5, 30),
+    "www.soccerbase.com": (5, 30),
+    "raw.githubusercontent.com": (5, 15),
+}
+DEFAULT_TIMEOUT = (5, 30)
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+FOREVER = float("inf")
+
+MATCH_LIST_CHUNK_DAYS = 31
+
+MATCH_COMPLETE = ["FULLTIME", "EXTRATIMECOMPLETE", "PENALTIESCOMPLETE"]
+POLL_INTERVAL = 2 * 60
+POLL_MAX_INTERVAL = 20 * 60
+POLL_TIMEOUT = 3 * 60 * 60
+SCHEDULER_MAX_SLEEP = 60 * 60
+
+MANAGERS_URL = "https://raw.githubusercontent.com/petebrown/pre-2023-data-prep/main/data/managers.csv"
+
+CACHE_TTLS = [
+    (r"soccerbase\.com/teams/", 15 * 60),
+    (r"bbc\.com/sport/football/league-two/table", 15 * 60),
+    (r"11v11\.com/league-tables/", 60 * 60),
+    (r"bbc-morph-football-scores-match-list-data", 5 * 60),
+    (r"bbc-morph-sport-football-team-lineups-data", 5 * 60),
+    (r"raw\.githubusercontent\.com", 24 * 60 * 60),
+]
+
+HOST_INTERVALS = {
+    "push.api.bbci.co.uk": 0.5,
+    "www.bbc.com": 1.0,
+    "www.11v11.com": 2.0,
+    "www.soccerbase.com": 2.0,
+    "raw.githubusercontent.com": 0.0,
+}
+
+EVENT_TABLES = [
+    "player_apps",
+    "subs",
+    "sub_mins",
+    "goals",
+    "yellow_cards",
+    "red_cards",
+]
+
+TABLES = ["results"] + EVENT_TABLES
 
 
 def get_headers():
@@ -13,8 +113,547 @@ def get_headers():
     return headers
 
 
+class run_report:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.stages = {}
+            self.hosts = {}
+            self.tables = {}
+
+    def add_stage(self, stage, seconds):
+        with self.lock:
+            totals = self.stages.setdefault(stage, {"calls": 0, "seconds": 0.0})
+            totals["calls"] += 1
+            totals["seconds"] += seconds
+
+    def add_request(self, url, r, seconds):
+        host = urlparse(url).netloc
+        with self.lock:
+            totals = self.hosts.setdefault(
+                host,
+                {
+                    "requests": 0,
+                    "cache_hits": 0,
+                    "errors": 0,
+                    "bytes": 0,
+                    "seconds": 0.0,
+                },
+            )
+            totals["requests"] += 1
+            totals["seconds"] += seconds
+            if r is None or r.status_code >= 400:
+                totals["errors"] += 1
+            if r is not None:
+                totals["cache_hits"] += r.from_cache
+                totals["bytes"] += len(r.content)
+
+    def add_table(self, df_name, **counts):
+        with self.lock:
+            totals = self.tables.setdefault(df_name, {})
+            for key, value in counts.items():
+                if isinstance(value, (int, float)) and key in totals:
+                    totals[key] += value
+                else:
+                    totals[key] = value
+
+    def get_summary(self, **extra):
+        with self.lock:
+            return {
+                "started_at": time.strftime(
+                    "%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started_at)
+                ),
+                "seconds": round(time.time() - self.started_at, 3),
+                **extra,
+                "stages": {
+                    stage: {**totals, "seconds": round(totals["seconds"], 3)}
+                    for stage, totals in self.stages.items()
+                },
+                "hosts": {
+                    host: {**totals, "seconds": round(totals["seconds"], 3)}
+                    for host, totals in self.hosts.items()
+                },
+                "tables": dict(self.tables),
+            }
+
+    def write(self, path=REPORT_PATH, **extra):
+        summary = self.get_summary(**extra)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps(summary, sort_keys=True) + "\n")
+        return summary
+
+
+report = run_report()
+
+
+def timed(stage):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                report.add_stage(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class rate_limiter:
+    def __init__(self, intervals=None, default_interval=1.0):
+        self.intervals = intervals if intervals is not None else HOST_INTERVALS
+        self.default_interval = default_interval
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        interval = self.intervals.get(host, self.default_interval)
+
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + interval
+
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class http_response:
+    def __init__(self, url, content, status_code=200, headers=None, from_cache=False):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class response_cache:
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def get_paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = f"{self.cache_dir}/{key[:2]}/{key}"
+        return f"{base}.json", f"{base}.body"
+
+    def get(self, url):
+        meta_path, body_path = self.get_paths(url)
+        if not (os.path.exists(meta_path) and os.path.exists(body_path)):
+            return None, None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(body_path, "rb") as f:
+            body = f.read()
+        return meta, body
+
+    def write_meta(self, url, meta):
+        meta_path = self.get_paths(url)[0]
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        with open(f"{meta_path}.tmp", "w") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+    def put(self, url, r):
+        body_path = self.get_paths(url)[1]
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        with open(f"{body_path}.tmp", "wb") as f:
+            f.write(r.content)
+        os.replace(f"{body_path}.tmp", body_path)
+
+        meta = {
+            "url": url,
+            "fetched_at": time.time(),
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "content_type": r.headers.get("Content-Type"),
+            "status_code": r.status_code,
+        }
+        self.write_meta(url, meta)
+
+    def touch(self, url, meta):
+        self.write_meta(url, {**meta, "fetched_at": time.time()})
+
+
+def get_ttl(url):
+    for pattern, ttl in CACHE_TTLS:
+        if re.search(pattern, url):
+            return ttl
+    return 0
+
+
+def get_match_ttl(date):
+    yesterday = pd.Timestamp.now(tz="Europe/London").normalize() - pd.Timedelta(days=1)
+    if pd.Timestamp(date).tz_localize("Europe/London") < yesterday:
+        return FOREVER
+    return None
+
+
+def get_cached_response(url, meta, body):
+    headers = {"Content-Type": meta.get("content_type")}
+    return http_response(url, body, headers=headers, from_cache=True)
+
+
+class http_client:
+    def __init__(
+        self,
+        cache=None,
+        limiter=None,
+        timeouts=None,
+        retries=3,
+        backoff_factor=1.0,
+        pool_size=MAX_WORKERS * 2,
+        recorder=None,
+        replay_url=None,
+    ):
+        self.cache = cache if cache is not None else response_cache()
+        self.limiter = limiter if limiter is not None else rate_limiter()
+        self.timeouts = timeouts if timeouts is not None else HOST_TIMEOUTS
+        self.recorder = recorder
+        self.replay_url = replay_url.rstrip("/") if replay_url else None
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.pool_size = pool_size
+
+    @cached_property
+    def session(self):
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry,
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+        )
+
+        session = requests.Session()
+        session.headers.update(get_headers())
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def get_timeout(self, url):
+        return self.timeouts.get(urlparse(url).netloc, DEFAULT_TIMEOUT)
+
+    def get_request_url(self, url):
+        if not self.replay_url:
+            return url
+        parts = urlparse(url)
+        query = f"?{parts.query}" if parts.query else ""
+        return f"{self.replay_url}/{parts.netloc}{parts.path}{query}"
+
+    def request(self, url, headers):
+        self.limiter.wait(url)
+        return self.session.get(
+            self.get_request_url(url), headers=headers, timeout=self.get_timeout(url)
+        )
+
+    def get(self, url, ttl=None):
+        start = time.perf_counter()
+        try:
+            r = self.get_response(url, ttl)
+        except requests.RequestException:
+            report.add_request(url, None, time.perf_counter() - start)
+            raise
+        report.add_request(url, r, time.perf_counter() - start)
+
+        if self.recorder is not None:
+            self.recorder.put(url, r)
+        return r
+
+    def get_response(self, url, ttl=None):
+        if ttl is None:
+            ttl = get_ttl(url)
+
+        meta, body = self.cache.get(url) if ttl else (None, None)
+        if meta and time.time() - meta["fetched_at"] < ttl:
+            return get_cached_response(url, meta, body)
+
+        headers = {}
+        if meta:
+            if meta["etag"]:
+                headers["If-None-Match"] = meta["etag"]
+            if meta["last_modified"]:
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            r = self.request(url, headers)
+        except requests.RequestException as e:
+            if meta:
+                print(f"Request to {url} failed ({e!r}), using cached copy.")
+                return get_cached_response(url, meta, body)
+            raise
+
+        if r.status_code == 304 and meta:
+            self.cache.touch(url, meta)
+            return get_cached_response(url, meta, body)
+
+        if r.status_code == 200 and ttl:
+            self.cache.put(url, r)
+        return http_response(url, r.content, r.status_code, dict(r.headers))
+
+
+def get_default_client():
+    recorder = response_cache(RECORD_DIR) if RECORD_DIR else None
+    if REPLAY_URL:
+        return http_client(
+            limiter=rate_limiter(intervals={}, default_interval=0),
+            recorder=recorder,
+            replay_url=REPLAY_URL,
+        )
+    return http_client(recorder=recorder)
+
+
+default_client = get_default_client()
+
+
+class run_memo:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = {}
+        self.saved = 0
+
+    def get(self, key, func, *args, **kwargs):
+        with self.lock:
+            future = self.results.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self.results[key] = future
+            else:
+                self.saved += 1
+
+        if is_owner:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                with self.lock:
+                    del self.results[key]
+                future.set_exception(e)
+        return future.result()
+
+    def clear(self):
+        with self.lock:
+            self.results = {}
+            self.saved = 0
+
+
+memo = run_memo()
+
+
+def fetch(url, ttl=None):
+    return default_client.get(url, ttl)
+
+
+def is_hidden(element):
+    return "display:none" in element.get("style", "").replace(" ", "")
+
+
+def remove_hidden(table):
+    # Same rule read_html applies with displayed_only=True, which the pages
+    # were always read with.
+    for element in table.xpath(".//style"):
+        element.drop_tree()
+    for element in table.xpath(".//*[@style]"):
+        if is_hidden(element):
+            element.drop_tree()
+
+
+def get_cell_text(cell):
+    return re.sub(r"[\r\n]+|\s{2,}", " ", cell.text_content().strip())
+
+
+def expand_rows(rows, remainder=None, overflow=True):
+    # Copies each cell into the columns and rows it spans, as read_html does.
+    all_texts = []
+    remainder = remainder if remainder is not None else []
+    for tr in rows:
+        texts, next_remainder, index = [], [], 0
+        for cell in tr.xpath("./td|./th"):
+            while remainder and remainder[0][0] <= index:
+                prev_index, prev_text, prev_rowspan = remainder.pop(0)
+                texts.append(prev_text)
+                if prev_rowspan > 1:
+                    next_remainder.append((prev_index, prev_text, prev_rowspan - 1))
+                index += 1
+
+            text = get_cell_text(cell)
+            rowspan = int(cell.get("rowspan") or 1)
+            colspan = int(cell.get("colspan") or 1)
+            for _ in range(colspan):
+                texts.append(text)
+                if rowspan > 1:
+                    next_remainder.append((index, text, rowspan - 1))
+                index += 1
+
+        for prev_index, prev_text, prev_rowspan in remainder:
+            texts.append(prev_text)
+            if prev_rowspan > 1:
+                next_remainder.append((prev_index, prev_text, prev_rowspan - 1))
+        all_texts.append(texts)
+        remainder = next_remainder
+
+    if not overflow:
+        while remainder:
+            all_texts.append([text for _, text, _ in remainder])
+            remainder = [(i, text, n - 1) for i, text, n in remainder if n > 1]
+    return all_texts, remainder
+
+
+def is_header_row(tr):
+    return all(cell.tag == "th" for cell in tr.xpath("./td|./th"))
+
+
+def get_header_rows(table):
+    rows = []
+    for thead in table.xpath(".//thead"):
+        rows.extend(thead.xpath("./tr"))
+        if thead.xpath("./td|./th"):
+            rows.append(thead)
+    return rows
+
+
+def split_table(table):
+    head_rows = get_header_rows(table)
+    body_rows = table.xpath(".//tbody//tr") + table.xpath("./tr")
+    foot_rows = table.xpath(".//tfoot//tr")
+    if not head_rows:
+        while body_rows and is_header_row(body_rows[0]):
+            head_rows.append(body_rows.pop(0))
+
+    head, remainder = expand_rows(head_rows)
+    body, remainder = expand_rows(body_rows, remainder, overflow=bool(foot_rows))
+    foot, _ = expand_rows(foot_rows, remainder, overflow=False)
+    return head, body, foot
+
+
+def table_to_df(head, body, foot):
+    header = None
+    if head:
+        body = head + body
+        if len(head) == 1:
+            header = 0
+        else:
+            header = [i for i, row in enumerate(head) if any(row)]
+    body = body + foot
+
+    width = max(len(row) for row in body)
+    body = [row + [""] * (width - len(row)) for row in body]
+    with pd.io.parsers.TextParser(body, header=header, thousands=",") as parser:
+        return parser.read()
+
+
+def has_columns(df, columns):
+    names = set()
+    for level in range(df.columns.nlevels):
+        names.update(df.columns.get_level_values(level).astype(str))
+    return set(columns) <= names
+
+
+@timed("parse_html")
+def read_table(content, columns):
+    if not importlib.util.find_spec("lxml"):
+        for df in pd.read_html(io.BytesIO(content), flavor="bs4"):
+            if has_columns(df, columns):
+                return df
+        raise ValueError(f"No table with columns {columns} found")
+
+    from lxml import html
+
+    doc = html.parse(io.BytesIO(content), html.HTMLParser(recover=True)).getroot()
+    for br in doc.iter("br"):
+        br.tail = "\n" + (br.tail or "")
+
+    # The table is picked by the header cells its caller reads, not by its
+    # position among the tables on the page.
+    for table in doc.iter("table"):
+        if is_hidden(table):
+            continue
+        remove_hidden(table)
+        head, body, foot = split_table(table)
+        if set(columns) <= {text for row in head for text in row}:
+            return table_to_df(head, body, foot)
+    raise ValueError(f"No table with columns {columns} found")
+
+
+FIXTURE_COLUMNS = ["Competition", "Home", "Away"]
+LEAGUE_TABLE_COLUMNS = {"11v11": ["Pos", "Team", "Pts"], "bbc": ["Team", "Points"]}
+
+FIXTURE_PATTERN = r"^(?:(?P<words>.*) )?(?P<game_date>[^ ]*) (?P<ko_time>[^ ]*)$"
+
+
+def get_competitions(words):
+    competitions = words.str.extract(r"^(.+) \1$")[0]
+
+    unmatched = competitions.isna() & words.notna()
+    halves = words[unmatched].str.split(" ").map(lambda split: split[: len(split) // 2])
+    competitions = competitions.where(~unmatched, halves.str.join(" "))
+    return competitions.fillna("")
+
+
+def clean_fixtures(df):
+    df = df.copy()
+    df.columns = df.columns.droplevel(0)
+
+    parts = df.Competition.str.extract(FIXTURE_PATTERN)
+
+    df["date_time"] = pd.to_datetime(
+        parts.game_date + " " + parts.ko_time
+    ).dt.tz_localize("Europe/London")
+    df["end_time"] = df.date_time + pd.Timedelta(hours=2.25)
+
+    df["game_date"] = df.date_time.dt.normalize()
+    df["day"] = df.game_date.dt.day_name()
+    df["ko_time"] = parts.ko_time
+
+    df["competition"] = get_competitions(parts.words)
+
+    is_home = df.Home.str.contains("Tranmere", regex=False, na=False)
+    df["venue"] = np.where(is_home, "H", "A")
+    df["opposition"] = np.where(is_home, df.Away.str[:-19], df.Home.str[:-19])
+
+    df = df[
+        [
+            "day",
+            "game_date",
+            "ko_time",
+            "opposition",
+            "venue",
+            "competition",
+            "date_time",
+            "end_time",
+        ]
+    ]
+
+    return df
+
+
 class fixtures:
-    def __init__(self, input_date=None):
+    def __init__(self, input_date=None, client=None):
+        self.client = client if client is not None else default_client
         if input_date:
             self.date = (
                 pd.to_datetime(input_date).tz_localize("Europe/London").normalize()
@@ -27,12 +666,12 @@ class fixtures:
             "https://www.soccerbase.com/teams/team.sd?team_id=2598&teamTabs=results"
         )
 
-        self.r = requests.get(self.url, headers=get_headers())
-        self.tables = pd.read_html(self.r.content, flavor="bs4")
-        self.df = self.tables[1].reset_index(drop=True)[:-6]
+        self.r = self.client.get(self.url)
+        table = read_table(self.r.content, FIXTURE_COLUMNS)
+        self.df = table.reset_index(drop=True)[:-6]
 
         self.all = self.clean_df()
-        self.list = self.clean_df()
+        self.list = self.all
         self.today = self.get_today()
         self.ready = self.get_ready()
         self.date_ready = self.get_date_to_scrape()
@@ -41,48 +680,7 @@ class fixtures:
         self.fixture = self.get_today()
 
     def clean_df(self):
-        df = self.df.copy()
-        df.columns = df.columns.droplevel(0)
-        col = df.Competition
-
-        df["date_time"] = pd.to_datetime(df.Competition.str[-16:]).dt.tz_localize(
-            "Europe/London"
-        )
-        df["end_time"] = df.date_time + pd.Timedelta(hours=2.25)
-
-        df["game_date"] = pd.to_datetime(
-            col.str.split(" ", expand=False).str[-2]
-        ).dt.tz_localize("Europe/London")
-        df["day"] = df.game_date.dt.day_name()
-        df["ko_time"] = col.str.split(" ", expand=False).str[-1]
-
-        df["competition"] = (
-            col.str.split(" ", expand=False)
-            .str[:-2]
-            .apply(lambda x: x[: len(x) // 2])
-            .str.join(" ")
-        )
-
-        df["venue"] = df.Home.apply(lambda x: "H" if "Tranmere" in x else "A")
-
-        df["opposition"] = df.apply(
-            lambda x: x.Away[:-19] if x.venue == "H" else x.Home[:-19], axis=1
-        )
-
-        df = df[
-            [
-                "day",
-                "game_date",
-                "ko_time",
-                "opposition",
-                "venue",
-                "competition",
-                "date_time",
-                "end_time",
-            ]
-        ]
-
-        return df
+        return clean_fixtures(self.df)
 
     def get_today(self):
         df = self.all.copy()
@@ -112,7 +710,8 @@ class fixtures:
 
 
 class league_table:
-    def __init__(self, date, table_source, pre_match=False, venue=None):
+    def __init__(self, date, table_source, pre_match=False, venue=None, client=None):
+        self.client = client if client is not None else default_client
         if pre_match is True:
             self.date = self.get_prematch_date(date)
         else:
@@ -122,13 +721,11 @@ class league_table:
         self.url = self.get_url()
 
         if table_source == "11v11":
-            r = requests.get(self.url, headers=get_headers())
-
-            self.tables = pd.read_html(r.content, flavor="bs4")
+            r = self.client.get(self.url, get_match_ttl(self.date))
         elif table_source == "bbc":
-            self.tables = pd.read_html(
-                "https://www.bbc.com/sport/football/league-two/table", flavor="bs4"
-            )
+            r = self.client.get("https://www.bbc.com/sport/football/league-two/table")
+
+        self.raw_table = read_table(r.content, LEAGUE_TABLE_COLUMNS[table_source])
 
         self.table = self.get_table(table_source)
         self.pos = self.get_pos()
@@ -173,7 +770,7 @@ class league_table:
         return df
 
     def get_table(self, table_source):
-        table = self.tables[0]
+        table = self.raw_table
 
         if table_source == "11v11":
             table.Pos = table.Pos.index + 1
@@ -182,63 +779,159 @@ class league_table:
         return table
 
     def get_pos(self):
+        # A missing row is stored as NA: league_pos and pts are integer
+        # columns, so a message in their place would fail the schema cast.
         try:
             pos = self.table.query("Team.str.contains('Tranmere')").Pos.values[0]
         except:
-            pos = "No table containing Tranmere Rovers found"
+            print("No table containing Tranmere Rovers found")
+            pos = None
         return pos
 
     def get_pts(self):
         try:
             pts = self.table.query("Team.str.contains('Tranmere')").Pts.values[0]
         except:
-            pts = "No table containing Tranmere Rovers found"
+            pts = None
         return pts
 
 
+def get_match_list_url(start_date, end_date):
+    url = f"https://push.api.bbci.co.uk/data/bbc-morph-football-scores-match-list-data/endDate/{end_date}/startDate/{start_date}/team/tranmere-rovers/todayDate/{end_date}/version/2.4.6/withPlayerActions/true?timeout=5"
+    return url
+
+
+def get_date_chunks(start_date, end_date, chunk_days=MATCH_LIST_CHUNK_DAYS):
+    chunk_start = pd.Timestamp(start_date)
+    end_date = pd.Timestamp(end_date)
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + pd.Timedelta(days=chunk_days - 1), end_date)
+        yield chunk_start.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d")
+        chunk_start = chunk_end + pd.Timedelta(days=1)
+
+
+def get_date_spans(dates, chunk_days=MATCH_LIST_CHUNK_DAYS):
+    # Only the days around the requested dates are fetched, so a few
+    # scattered gaps cost a request each rather than the months between them.
+    spans = []
+    for date in sorted(map(pd.Timestamp, dates)):
+        if spans and date - spans[-1][0] < pd.Timedelta(days=chunk_days):
+            spans[-1][1] = date
+        else:
+            spans.append([date, date])
+    return [
+        (start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")) for start, end in spans
+    ]
+
+
+def get_event_date(date_key, event):
+    if re.match(r"\d{4}-\d{2}-\d{2}", date_key):
+        return date_key[:10]
+    return event["startTime"][:10]
+
+
+def split_match_list(match_list):
+    match_lists = {}
+    for tournament in match_list["matchData"] or []:
+        for date_key, rounds in tournament["tournamentDatesWithEvents"].items():
+            for round_data in rounds:
+                for event in round_data["events"]:
+                    date = get_event_date(date_key, event)
+                    single_round = {**round_data, "events": [event]}
+                    match_lists.setdefault(
+                        date,
+                        {
+                            "matchData": [
+                                {
+                                    "tournamentMeta": tournament["tournamentMeta"],
+                                    "tournamentDatesWithEvents": {
+                                        date_key: [single_round]
+                                    },
+                                }
+                            ]
+                        },
+                    )
+    return match_lists
+
+
+def get_match_lists(start_date, end_date, client=None):
+    chunks = list(get_date_chunks(start_date, end_date))
+    match_lists = fetch_match_lists(chunks, client)
+    print(
+        f"Found {len(match_lists)} match(es) between {start_date} and {end_date} "
+        f"in {len(chunks)} request(s)."
+    )
+    return match_lists
+
+
+def get_match_lists_for(dates, client=None):
+    spans = get_date_spans(dates)
+    match_lists = fetch_match_lists(spans, client)
+    print(
+        f"Found {len(match_lists)} match(es) around {len(dates)} date(s) "
+        f"in {len(spans)} request(s)."
+    )
+    return match_lists
+
+
+def fetch_match_lists(chunks, client=None):
+    client = client if client is not None else default_client
+
+    match_lists = {}
+    for chunk_start, chunk_end in chunks:
+        url = get_match_list_url(chunk_start, chunk_end)
+        r = memo.get(("match_list", url), client.get, url, get_match_ttl(chunk_end))
+        if r.status_code != 200:
+            raise match_data_error(f"BBC returned HTTP {r.status_code} for {url}")
+        match_lists.update(split_match_list(r.json()))
+    return match_lists
+
+
+class match_not_found(LookupError):
+    pass
+
+
+class match_data_error(Exception):
+    pass
+
+
+def match_field(method):
+    @wraps(method)
+    def field(self):
+        try:
+            return method(self)
+        except (KeyError, IndexError, TypeError, ValueError, StopIteration) as e:
+            raise match_data_error(
+                f"Unexpected BBC data for {self.date} in {method.__name__}: {e!r}"
+            ) from e
+
+    return cached_property(field)
+
+
 class bbc_api:
-    def __init__(self, date):
+    def __init__(self, date, client=None, match_list=None):
         self.date = date
-
+        self.client = client if client is not None else default_client
         self.match_url = self.get_match_url()
-        self.match_list = self.get_match_list()
-        try:
-            self.match_key = self.get_match_key()
-            self.event_key = self.get_event_key()
-            self.tournament_data = self.get_tournament_data()
-            self.match_data = self.get_match_data()
-            self.cup_data = self.get_cup_data()
-            self.tranmere, self.opponent = self.get_teams()
-            self.opp_name = self.match_data[self.opponent]["name"]["full"]
-            self.teams = self.print_teams()
-            self.goals_for, self.goals_against, self.score = self.get_score()
-
-            self.lineup_url = self.get_lineup_url()
-            self.lineup_data = self.get_lineup_data()
-            self.tranmere_players = self.lineup_data["teams"][self.tranmere]["players"]
-            self.opp_players = self.lineup_data["teams"][self.opponent]["players"]
-            self.attendance = self.get_attendance()
-            self.referee = self.get_referee()
-            self.stadium = self.get_stadium()
-            self.venue = self.get_venue()
-            self.ko_time = self.get_ko_time()
-            self.formation = self.get_formation()
-        except:
-            return None
+        if match_list is not None:
+            self.match_list = match_list
 
     def get_match_url(self):
-        url = f"https://push.api.bbci.co.uk/data/bbc-morph-football-scores-match-list-data/endDate/{self.date}/startDate/{self.date}/team/tranmere-rovers/todayDate/{self.date}/version/2.4.6/withPlayerActions/true?timeout=5"
+        url = get_match_list_url(self.date, self.date)
         return url
 
+    def get_json(self, url):
+        r = self.client.get(url, get_match_ttl(self.date))
+        if r.status_code != 200:
+            raise match_data_error(f"BBC returned HTTP {r.status_code} for {url}")
+        return r.json()
+
     def get_match_list(self):
-        r = requests.get(self.match_url, headers=get_headers())
-        match_list = r.json()
+        match_list = self.get_json(self.match_url)
 
         if not match_list["matchData"]:
-            print(f"No matches found for {self.date}")
-            return
-        else:
-            return match_list
+            raise match_not_found(f"No matches found for {self.date}")
+        return match_list
 
     def get_match_key(self):
         match_key = next(
@@ -273,8 +966,7 @@ class bbc_api:
         return url
 
     def get_lineup_data(self):
-        r = requests.get(self.lineup_url, headers=get_headers())
-        lineup_data = r.json()
+        lineup_data = self.get_json(self.lineup_url)
         return lineup_data
 
     def get_teams(self):
@@ -290,12 +982,23 @@ class bbc_api:
         second_team = self.match_data[self.opponent]["name"]["full"]
         print(f"Tranmere are {self.tranmere}. {second_team} are {self.opponent}")
 
+    def get_opp_name(self):
+        self.print_teams()
+        opp_name = self.match_data[self.opponent]["name"]["full"]
+        return opp_name
+
     def get_score(self):
         goals_for = self.match_data[self.tranmere]["scores"]["score"]
         goals_against = self.match_data[self.opponent]["scores"]["score"]
         score = f"{goals_for}-{goals_against}"
         return goals_for, goals_against, score
 
+    def get_tranmere_players(self):
+        return self.lineup_data["teams"][self.tranmere]["players"]
+
+    def get_opp_players(self):
+        return self.lineup_data["teams"][self.opponent]["players"]
+
     def get_attendance(self):
         if "attendance" in self.lineup_data["meta"].keys():
             attendance = self.lineup_data["meta"]["attendance"].replace(",", "")
@@ -334,6 +1037,47 @@ class bbc_api:
         ko_time = self.match_data["startTimeInUKHHMM"]
         return ko_time
 
+    match_list = match_field(get_match_list)
+    match_key = match_field(get_match_key)
+    event_key = match_field(get_event_key)
+    tournament_data = match_field(get_tournament_data)
+    match_data = match_field(get_match_data)
+    cup_data = match_field(get_cup_data)
+    teams = match_field(get_teams)
+    opp_name = match_field(get_opp_name)
+    scores = match_field(get_score)
+    stadium = match_field(get_stadium)
+    venue = match_field(get_venue)
+    ko_time = match_field(get_ko_time)
+
+    lineup_url = match_field(get_lineup_url)
+    lineup_data = match_field(get_lineup_data)
+    tranmere_players = match_field(get_tranmere_players)
+    opp_players = match_field(get_opp_players)
+    attendance = match_field(get_attendance)
+    referee = match_field(get_referee)
+    formation = match_field(get_formation)
+
+    @property
+    def tranmere(self):
+        return self.teams[0]
+
+    @property
+    def opponent(self):
+        return self.teams[1]
+
+    @property
+    def goals_for(self):
+        return self.scores[0]
+
+    @property
+    def goals_against(self):
+        return self.scores[1]
+
+    @property
+    def score(self):
+        return self.scores[2]
+
 
 def get_season(date):
     month = int(date.split("-")[1])
@@ -374,8 +1118,14 @@ def get_game_type(data):
         return "Cup"
 
 
-def get_table(date, table_source):
-    lge_table = league_table(date, table_source)
+def get_league_table(date, table_source, venue=None, client=None):
+    table_date = None if table_source == "bbc" else date
+    key = ("league_table", table_date, table_source, venue)
+    return memo.get(key, league_table, date, table_source, venue=venue, client=client)
+
+
+def get_table(date, table_source, client=None):
+    lge_table = get_league_table(date, table_source, client=client)
     pos = lge_table.pos
     pts = lge_table.pts
     return pos, pts
@@ -401,13 +1151,54 @@ def get_league_tier(competition):
     return league_tiers[competition]
 
 
+class manager_index:
+    def __init__(self, df):
+        df = df.sort_values(["date_from", "date_to"], kind="mergesort")
+        self.starts = df.date_from.to_numpy(dtype="datetime64[ns]")
+        self.ends = df.date_to.to_numpy(dtype="datetime64[ns]")
+        self.names = df.manager_name.to_numpy(dtype=object)
+
+    def lookup_many(self, dates):
+        dates = pd.to_datetime(pd.Series(dates)).to_numpy(dtype="datetime64[ns]")
+
+        idx = np.searchsorted(self.starts, dates, side="right") - 1
+        # On handover days two spells contain the date; keep the outgoing one.
+        prev = (idx - 1).clip(0)
+        use_prev = (idx > 0) & (self.ends[prev] >= dates)
+        idx = np.where(use_prev, prev, idx)
+
+        found = (idx >= 0) & (self.ends[idx.clip(0)] >= dates)
+        return np.where(found, self.names[idx.clip(0)], None)
+
+    def lookup(self, date):
+        return self.lookup_many([date])[0]
+
+
+def load_manager_index(source):
+    if source == "local":
+        managers = f"{DATA_DIR}/managers.csv"
+    else:
+        managers = io.BytesIO(fetch(MANAGERS_URL).content)
+    df = pd.read_csv(managers, parse_dates=["date_from", "date_to"])
+    return manager_index(df)
+
+
+def get_managers(dates):
+    local = memo.get(("managers", "local"), load_manager_index, "local")
+    names = local.lookup_many(dates)
+
+    missing = pd.isna(names)
+    if missing.any():
+        remote = memo.get(("managers", "remote"), load_manager_index, "remote")
+        names[missing] = remote.lookup_many(pd.Series(dates)[missing])
+    return names
+
+
 def get_manager(date):
-    df = pd.read_csv(
-        "https://raw.githubusercontent.com/petebrown/pre-2023-data-prep/main/data/managers.csv",
-        parse_dates=["date_from", "date_to"],
-    )
-    df = df[(df.date_from <= date) & (df.date_to >= date)]
-    return df.manager_name.values[0]
+    manager = get_managers([date])[0]
+    if manager is None:
+        print(f"No manager found for {date}")
+    return manager
 
 
 def get_cup_leg(match_data):
@@ -528,15 +1319,12 @@ def get_outcome_desc(pen_outcome, pen_score, agg_outcome, agg_score):
     return outcome_desc
 
 
-def get_match_df(date, table_source, data=None):
+def get_match_df(date, table_source, data=None, manager=None):
     if data:
         data = data
     else:
         data = bbc_api(date)
-    try:
-        match_data = data.match_data
-    except:
-        print("No match data available. Try a different date.")
+    match_data = data.match_data
 
     season = get_season(date)
     game_date = data.date
@@ -582,14 +1370,17 @@ def get_match_df(date, table_source, data=None):
     decider = get_decider(match_data)
     outcome_desc = get_outcome_desc(pen_outcome, pen_score, agg_outcome, agg_score)
 
-    manager = get_manager(date)
+    if manager is None:
+        manager = get_manager(date)
     attendance = data.attendance
     game_length = 90 if aet is None else 120
     stadium = data.stadium
     referee = data.referee
 
-    league_pos = get_table(date, table_source)[0] if game_type == "League" else None
-    pts = get_table(date, table_source)[1] if game_type == "League" else None
+    if game_type == "League":
+        league_pos, pts = get_table(date, table_source, data.client)
+    else:
+        league_pos, pts = None, None
 
     match_record = [
         {
@@ -638,6 +1429,34 @@ def get_match_df(date, table_source, data=None):
     return match_record
 
 
+EVENT_COLUMNS = {
+    "goals": ["game_date", "player_name", "goal_min", "penalty", "own_goal"],
+    "player_apps": ["game_date", "player_name", "shirt_no", "role"],
+    "subs": ["game_date", "shirt_no", "player_name", "on_for", "off_for"],
+    "sub_mins": ["game_date", "player_name", "min_off", "min_on"],
+    "cards": ["game_date", "player_name", "minute", "card_type"],
+}
+
+
+def get_shirt_no(player):
+    try:
+        return player["meta"]["uniformNumber"]
+    except (KeyError, TypeError):
+        return None
+
+
+class event_buffer:
+    def __init__(self, columns):
+        self.columns = {col: [] for col in columns}
+
+    def add(self, *values):
+        for col, value in zip(self.columns.values(), values):
+            col.append(value)
+
+    def to_df(self):
+        return pd.DataFrame(self.columns)
+
+
 class events_df:
     def __init__(self, date, data=None):
         self.date = pd.to_datetime(date)
@@ -649,81 +1468,60 @@ class events_df:
         self.players = self.data.tranmere_players
 
         self.goals = self.get_goals_df()
-        self.subs = self.get_subs()[0]
-        self.player_apps = self.get_apps()
-        self.sub_mins = self.get_subs()[1]
-        self.cards = self.get_cards()
+        self.player_apps, self.subs, self.sub_mins, self.cards = self.get_lineup_dfs()
         self.yellow_cards = self.get_yellow_cards()
         self.red_cards = self.get_red_cards()
 
     def get_goals_df(self):
         player_actions = self.match_data[self.data.tranmere]["playerActions"]
 
-        goals = []
+        goals = event_buffer(EVENT_COLUMNS["goals"])
         for player in player_actions:
             player_name = player["name"]["full"]
-            actions = player["actions"]
-            for action in actions:
+            for action in player["actions"]:
                 if action["type"] == "goal":
-                    goal = {
-                        "game_date": self.date,
-                        "player_name": player_name,
-                        "goal_min": action["timeElapsed"],
-                        "penalty": action["penalty"],
-                        "own_goal": action["ownGoal"],
-                    }
-                    goals.append(goal)
-
-        goals_df = pd.DataFrame(goals)
-        return goals_df
-
-    def get_apps(self):
-        player_apps = []
-        for player in self.players:
-            player_name = player["name"]["full"]
-            try:
-                shirt_no = player["meta"]["uniformNumber"]
-            except:
-                shirt_no = None
-            role = player["meta"]["status"].replace("bench", "sub")
-
-            player_app = {
-                "game_date": self.date,
-                "player_name": player_name,
-                "shirt_no": shirt_no,
-                "role": role,
-            }
-            player_apps.append(player_app)
-
-        apps_df = pd.DataFrame(player_apps)
-        if self.subs.empty:
-            apps_df = apps_df.query(
-                "role == 'starter'"
-            )
-        else:
-            apps_df = apps_df.query(
-                "player_name.isin(@self.subs.player_name) | role == 'starter'"
-            )
-        return apps_df
-
-    def get_cards(self):
-        player_cards = []
+                    goals.add(
+                        self.date,
+                        player_name,
+                        action["timeElapsed"],
+                        action["penalty"],
+                        action["ownGoal"],
+                    )
+        return goals.to_df()
+
+    def get_lineup_dfs(self):
+        apps = event_buffer(EVENT_COLUMNS["player_apps"])
+        subs = event_buffer(EVENT_COLUMNS["subs"])
+        sub_mins = event_buffer(EVENT_COLUMNS["sub_mins"])
+        cards = event_buffer(EVENT_COLUMNS["cards"])
+        subbed = set()
 
         for player in self.players:
             player_name = player["name"]["full"]
-            cards = player["bookings"]
-            if cards:
-                for card in cards:
-                    player_card = {
-                        "game_date": self.date,
-                        "player_name": player_name,
-                        "minute": card["timeElapsed"],
-                        "card_type": card["type"],
-                    }
-                    player_cards.append(player_card)
-
-        cards_df = pd.DataFrame(player_cards)
-        return cards_df
+            shirt_no = get_shirt_no(player)
+            role = player["meta"]["status"].replace("bench", "sub")
+            apps.add(self.date, player_name, shirt_no, role)
+
+            if player["substitutions"]:
+                sub = player["substitutions"][0]
+                sub_min = sub["timeElapsed"]
+                sub_on_no = get_shirt_no(sub["replacedBy"])
+                player_on = sub["replacedBy"]["name"]["full"]
+
+                sub_mins.add(self.date, player_on, None, sub_min)
+                sub_mins.add(self.date, player_name, sub_min, None)
+                subs.add(self.date, sub_on_no, player_on, shirt_no, None)
+                subs.add(self.date, shirt_no, player_name, None, sub_on_no)
+                subbed.update([player_on, player_name])
+
+            for card in player["bookings"] or []:
+                cards.add(self.date, player_name, card["timeElapsed"], card["type"])
+
+        apps_df = apps.to_df()
+        apps_df = apps_df[
+            (apps_df.role == "starter") | apps_df.player_name.isin(subbed)
+        ]
+        return apps_df, subs.to_df(), sub_mins.to_df(), cards.to_df()
 
     def get_yellow_cards(self):
         cards = self.cards
@@ -757,138 +1555,1268 @@ class events_df:
             print("No red cards (No cards at all)")
             return None
 
-    def get_subs(self):
-        player_subs = []
-        player_sub_mins = []
-
-        for player in self.players:
-            player_name = player["name"]["full"]
-            try:
-                shirt_no = player["meta"]["uniformNumber"]
-            except:
-                shirt_no = None
-
-            subs = player["substitutions"]
-            if subs:
-                sub_min = subs[0]["timeElapsed"]
-                try:
-                    sub_on_no = subs[0]["replacedBy"]["meta"]["uniformNumber"]
-                except:
-                    sub_on_no = None
-                player_on = subs[0]["replacedBy"]["name"]["full"]
-
-                sub_on_mins = {
-                    "game_date": self.date,
-                    "player_name": player_on,
-                    "min_off": None,
-                    "min_on": sub_min,
-                }
-                sub_off_mins = {
-                    "game_date": self.date,
-                    "player_name": player_name,
-                    "min_off": sub_min,
-                    "min_on": None,
-                }
-                player_sub_mins.extend([sub_on_mins, sub_off_mins])
-
-                sub_on = {
-                    "game_date": self.date,
-                    "shirt_no": sub_on_no,
-                    "player_name": player_on,
-                    "on_for": shirt_no,
-                    "off_for": None,
-                }
-                sub_off = {
-                    "game_date": self.date,
-                    "shirt_no": shirt_no,
-                    "player_name": player_name,
-                    "on_for": None,
-                    "off_for": sub_on_no,
-                }
-                player_subs.extend([sub_on, sub_off])
-
-        subs_df = pd.DataFrame(player_subs)
-        sub_mins_df = pd.DataFrame(player_sub_mins)
-        return subs_df, sub_mins_df
-
 
 def get_timestamp():
     timestamp = pd.Timestamp.now(tz="America/New_York").strftime("%Y-%m-%d-%H%M%S")
     return timestamp
 
 
-def archive_csv(df_name, old_df):
-    timestamp = get_timestamp()
+def get_object_path(digest):
+    return f"{ARCHIVE_DIR}/objects/{digest[:2]}/{digest}.csv.gz"
 
-    archive_dir = f"./archive/{timestamp}"
-    print(archive_dir)
 
-    if not os.path.exists(archive_dir):
-        os.makedirs(archive_dir)
-        print(f"Created archive directory at {archive_dir}")
+def put_object(data):
+    digest = hashlib.sha256(data).hexdigest()
+    object_path = get_object_path(digest)
 
-    archive_path = f"{archive_dir}/{df_name}.csv"
+    if os.path.exists(object_path):
+        return digest, False
 
-    old_df.to_csv(archive_path, index=False)
-    print(f"{df_name.upper()} archived to {archive_path}")
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    tmp_path = f"{object_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(gzip.compress(data, mtime=0))
+    os.replace(tmp_path, object_path)
+    return digest, True
 
 
-def get_existing_dates():
-    dates = (
-        pd.read_csv("./data/results.csv", usecols=["game_date"])
-        .sort_values(by="game_date", ascending=False)["game_date"]
-        .drop_duplicates()
+def get_object(digest):
+    with open(get_object_path(digest), "rb") as f:
+        return gzip.decompress(f.read())
+
+
+def chunk_csv(data):
+    lines = data.decode("utf-8").splitlines(keepends=True)
+    if not lines:
+        return "", []
+
+    header, body = lines[0], lines[1:]
+    columns = next(csv.reader([header]))
+    rows = list(csv.reader(body))
+
+    if "game_date" not in columns or len(rows) != len(body):
+        return header, ["".join(body)]
+
+    date_col = columns.index("game_date")
+    chunks = []
+    chunk_year = None
+    for line, row in zip(body, rows):
+        year = row[date_col][:4] if len(row) > date_col else None
+        if chunks and year == chunk_year:
+            chunks[-1].append(line)
+        else:
+            chunks.append([line])
+            chunk_year = year
+    return header, ["".join(chunk) for chunk in chunks]
+
+
+def store_snapshot(df_name, data, timestamp):
+    header, chunks = chunk_csv(data)
+
+    digests = []
+    n_new = 0
+    for chunk in chunks:
+        digest, created = put_object(chunk.encode("utf-8"))
+        digests.append(digest)
+        n_new += created
+
+    snapshot = {
+        "table": df_name,
+        "timestamp": timestamp,
+        "header": header,
+        "chunks": digests,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "size": len(data),
+    }
+
+    snapshot_dir = f"{ARCHIVE_DIR}/snapshots/{timestamp}"
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot_path = f"{snapshot_dir}/{df_name}.json"
+    with open(snapshot_path, "w") as f:
+        json.dump(snapshot, f, indent=1)
+
+    return snapshot_path, len(chunks), n_new
+
+
+def link_snapshot(df_name, source_timestamp, timestamp):
+    with open(f"{ARCHIVE_DIR}/snapshots/{source_timestamp}/{df_name}.json") as f:
+        snapshot = json.load(f)
+    snapshot["timestamp"] = timestamp
+
+    snapshot_dir = f"{ARCHIVE_DIR}/snapshots/{timestamp}"
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot_path = f"{snapshot_dir}/{df_name}.json"
+    with open(snapshot_path, "w") as f:
+        json.dump(snapshot, f, indent=1)
+    return snapshot_path
+
+
+@timed("archive_csv")
+def archive_csv(df_name, timestamp=None):
+    if timestamp is None:
+        timestamp = get_timestamp()
+
+    manifest = read_json(f"{ARCHIVE_DIR}/manifest.json", {})
+    source_hash = storage.get_hash(df_name)
+    last = manifest.get(df_name)
+    if last and last["source"] == source_hash:
+        snapshot_path = link_snapshot(df_name, last["snapshot"], timestamp)
+        report.add_table(df_name, archive_chunks=0, archive_new_chunks=0)
+        print(f"{df_name.upper()} unchanged, {snapshot_path} reuses {last['snapshot']}")
+        return
+
+    data = storage.read_bytes(df_name)
+
+    snapshot_path, n_chunks, n_new = store_snapshot(df_name, data, timestamp)
+    manifest[df_name] = {"source": source_hash, "snapshot": timestamp}
+    write_json(f"{ARCHIVE_DIR}/manifest.json", manifest)
+    report.add_table(df_name, archive_chunks=n_chunks, archive_new_chunks=n_new)
+    print(
+        f"{df_name.upper()} archived to {snapshot_path} "
+        f"({n_new} new of {n_chunks} chunks)"
+    )
+
+
+def list_dirs(path):
+    if not os.path.exists(path):
+        return []
+    return [name for name in os.listdir(path) if os.path.isdir(f"{path}/{name}")]
+
+
+def list_snapshots():
+    # Legacy snapshots are directories in the archive root, next to the
+    # object store and manifest.json.
+    timestamps = set(list_dirs(f"{ARCHIVE_DIR}/snapshots"))
+    timestamps.update(
+        name for name in list_dirs(ARCHIVE_DIR) if name not in ["objects", "snapshots"]
+    )
+    return sorted(timestamps)
+
+
+def restore_bytes(timestamp, df_name):
+    legacy_path = f"{ARCHIVE_DIR}/{timestamp}/{df_name}.csv"
+    if os.path.exists(legacy_path):
+        with open(legacy_path, "rb") as f:
+            return f.read()
+
+    with open(f"{ARCHIVE_DIR}/snapshots/{timestamp}/{df_name}.json") as f:
+        snapshot = json.load(f)
+
+    data = snapshot["header"].encode("utf-8") + b"".join(
+        get_object(digest) for digest in snapshot["chunks"]
     )
+    if hashlib.sha256(data).hexdigest() != snapshot["sha256"]:
+        raise ValueError(f"Archived {df_name} for {timestamp} failed its checksum")
+    return data
+
+
+def restore(timestamp, df_name, path=None):
+    data = restore_bytes(timestamp, df_name)
+    if path:
+        with open(path, "wb") as f:
+            f.write(data)
+    return pd.read_csv(io.BytesIO(data), parse_dates=["game_date"])
+
+
+def migrate_archive():
+    for timestamp in list_snapshots():
+        legacy_dir = f"{ARCHIVE_DIR}/{timestamp}"
+        if not os.path.isdir(legacy_dir):
+            continue
+        for file_name in sorted(os.listdir(legacy_dir)):
+            df_name = file_name.removesuffix(".csv")
+            data = restore_bytes(timestamp, df_name)
+            store_snapshot(df_name, data, timestamp)
+            os.remove(f"{legacy_dir}/{file_name}")
+            print(f"Migrated {legacy_dir}/{file_name}")
+        os.rmdir(legacy_dir)
+
+
+def normalize_date(date):
+    return pd.Timestamp(date).strftime("%Y-%m-%d")
+
+
+def get_existing_dates():
+    game_dates = storage.load("results", columns=["game_date"]).game_date
+    dates = set(game_dates.dt.strftime("%Y-%m-%d"))
     return dates
 
 
-def check_dates(dates):
+def parse_uk_times(col):
+    return pd.to_datetime(col, utc=True).dt.tz_convert("Europe/London")
+
+
+class fixture_calendar:
+    # Only the scraped fixtures are stored: the rows derived from RESULTS
+    # are rebuilt on load, and the scrape time lives in the cache directory,
+    # so a refresh that finds the same fixtures leaves data/ untouched.
+    def __init__(
+        self,
+        path=CALENDAR_PATH,
+        max_age=CALENDAR_MAX_AGE,
+        state_path=CALENDAR_STATE_PATH,
+    ):
+        self.path = path
+        self.state_path = state_path
+        self.max_age = pd.Timedelta(seconds=max_age)
+        self.manifest = content_manifest(os.path.dirname(path))
+        self.scraped = self.load_scraped()
+        self.df = self.load()
+
+    def load_scraped(self):
+        if not os.path.exists(self.path):
+            return None
+        df = pd.read_csv(self.path, dtype={"ko_time": str})
+        if "source" in df:
+            # Calendars written before the results rows were left out.
+            df = df[df.source == "soccerbase"].reset_index(drop=True)
+            df = df.drop(columns=["source", "scraped_at"], errors="ignore")
+        for col in ["game_date", "date_time", "end_time"]:
+            df[col] = parse_uk_times(df[col])
+        return df
+
+    def load(self):
+        df = self.get_results_fixtures()
+        if self.scraped is not None:
+            scraped = self.scraped.assign(source="soccerbase")
+            df = pd.concat([df[~df.game_date.isin(scraped.game_date)], scraped])
+        return self.index_by_date(df)
+
+    def index_by_date(self, df):
+        df = df.sort_values("date_time", kind="mergesort")
+        df.index = df.game_date.dt.strftime("%Y-%m-%d").rename("date")
+        return df
+
+    def get_results_fixtures(self):
+        results = storage.load(
+            "results",
+            columns=["game_date", "ko_time", "opposition", "venue", "competition"],
+        )
+        ko_time = results.ko_time.astype("string").str[:5]
+        ko_offset = pd.to_timedelta(ko_time.fillna("00:00") + ":00")
+        game_date = results.game_date.dt.tz_localize("Europe/London")
+
+        df = pd.DataFrame(
+            {
+                "day": game_date.dt.day_name(),
+                "game_date": game_date,
+                "ko_time": ko_time,
+                "opposition": results.opposition,
+                "venue": results.venue,
+                "competition": results.competition,
+                "date_time": game_date + ko_offset,
+            }
+        )
+        df["end_time"] = df.date_time + pd.Timedelta(hours=2.25)
+        df["source"] = "results"
+        return df
+
+    def get_last_scraped(self):
+        scraped_at = read_json(self.state_path, {}).get("scraped_at")
+        return (
+            pd.Timestamp(scraped_at).tz_convert("Europe/London")
+            if scraped_at
+            else pd.NaT
+        )
+
+    def is_stale(self, now=None):
+        now = now if now is not None else pd.Timestamp.now(tz="Europe/London")
+        last_scraped = self.get_last_scraped()
+        return pd.isna(last_scraped) or now - last_scraped > self.max_age
+
+    def refresh(self, client=None):
+        now = pd.Timestamp.now(tz="Europe/London")
+        self.scraped = fixtures(client=client).all.copy()
+        self.df = self.load()
+        written = self.save()
+        write_json(self.state_path, {"scraped_at": now.isoformat()})
+        state = "refreshed" if written else "unchanged"
+        print(f"Fixture calendar {state} with {len(self.scraped)} scraped fixtures.")
+
+    def ensure_fresh(self, client=None):
+        if not self.is_stale():
+            return
+        try:
+            self.refresh(client)
+        except Exception as e:
+            if self.scraped is None:
+                raise
+            print(f"Could not refresh fixture calendar ({e!r}), using stored copy.")
+
+    def save(self):
+        df = self.scraped.copy()
+        for col in ["game_date", "date_time", "end_time"]:
+            df[col] = df[col].map(lambda x: x.isoformat() if pd.notna(x) else None)
+        data = df.to_csv(index=False, lineterminator="\n").encode("utf-8")
+        return self.manifest.write_file(self.path, data)
+
+    def get_day(self, date):
+        return self.df[self.df.index == date].reset_index(drop=True)
+
+    def get_played(self, existing_dates, now=None):
+        now = now if now is not None else pd.Timestamp.now(tz="Europe/London")
+        played = self.df[self.df.end_time < now]
+        missing = ~played.index.isin(list(existing_dates))
+        return played.index[missing].unique().tolist()
+
+    def get_unplayed(self, existing_dates, since):
+        unplayed = self.df[self.df.end_time > since]
+        missing = ~unplayed.index.isin(list(existing_dates))
+        return unplayed[missing].sort_values("end_time", kind="mergesort")
+
+
+def is_date_range(dates):
+    return isinstance(dates, str) and ".." in dates
+
+
+def get_range_match_lists(dates, client=None):
+    # Memoised per run, so backfill reuses the lists check_dates found the
+    # missing dates in instead of fetching the range again.
+    start_date, end_date = map(normalize_date, dates.split(".."))
+    key = ("match_lists", start_date, end_date)
+    return memo.get(key, get_match_lists, start_date, end_date, client)
+
+
+@timed("check_dates")
+def check_dates(dates, client=None, existing_dates=None):
+    if dates in ["played", "all", "available"] or is_date_range(dates):
+        if existing_dates is None:
+            existing_dates = get_existing_dates()
+
+    if is_date_range(dates):
+        today = pd.Timestamp.now(tz="Europe/London").strftime("%Y-%m-%d")
+        match_lists = get_range_match_lists(dates, client)
+        dates = [
+            date
+            for date in sorted(match_lists)
+            if date < today and date not in existing_dates
+        ]
+        print(f"{len(dates)} played game(s) in range missing from RESULTS.")
+        return dates
+
+    calendar = fixture_calendar()
+    calendar.ensure_fresh(client)
+
     if dates in ["played", "all", "available"]:
-        f = fixtures()
-        dates = f.played["game_date"].dt.date.astype(str).unique().tolist()
+        dates = calendar.get_played(existing_dates)
+        print(f"{len(dates)} played game(s) missing from RESULTS.")
     else:
-        f = fixtures(dates)
-        if f.today.empty:
+        date = pd.to_datetime(dates) if dates else pd.Timestamp.now(tz="Europe/London")
+        today = calendar.get_day(date.strftime("%Y-%m-%d"))
+        ready = today[today.end_time < pd.Timestamp.now(tz="Europe/London")]
+        if today.empty:
             print("No game today.")
             dates = None
-        elif not f.date_ready:
+        elif ready.empty:
             print(
-                f"There is a game today against {f.today.opposition.values[0]}, but it is not ready for update. Please try again later."
+                f"There is a game today against {today.opposition.values[0]}, but it is not ready for update. Please try again later."
             )
             dates = None
         else:
             print(
-                f"Update available for today's game against {f.today.opposition.values[0]}"
+                f"Update available for today's game against {today.opposition.values[0]}"
             )
-            dates = [f.date_ready]
+            dates = [ready.game_date.dt.strftime("%Y-%m-%d").values[0]]
     return dates
 
 
-def update_csv(df_name, old_df, updates):
-    sort_cols = {
-        "goals": ["game_date", "goal_min"],
-        "player_apps": ["game_date", "role", "shirt_no"],
-        "subs": ["game_date"],
-        "sub_mins": ["game_date"],
-        "yellow_cards": ["game_date", "min_yc"],
-        "red_cards": ["game_date", "min_so"],
-        "results": "game_date",
+SORT_COLS = {
+    "goals": ["game_date", "goal_min"],
+    "player_apps": ["game_date", "role", "shirt_no"],
+    "subs": ["game_date"],
+    "sub_mins": ["game_date"],
+    "yellow_cards": ["game_date", "min_yc"],
+    "red_cards": ["game_date", "min_so"],
+    "results": "game_date",
+}
+
+SCHEMAS = {
+    "results": {
+        "season": "category",
+        "game_date": "date",
+        "game_no": "Int16",
+        "opposition": "category",
+        "venue": "category",
+        "score": "category",
+        "outcome": "category",
+        "goals_for": "Int8",
+        "goals_against": "Int8",
+        "goal_diff": "Int8",
+        "game_type": "category",
+        "competition": "category",
+        "generic_comp": "category",
+        "ssn_comp_game_no": "Int16",
+        "league_tier": "Int8",
+        "league_pos": "Int8",
+        "pts": "Int16",
+        "attendance": "Int32",
+        "weekday": "category",
+        "manager": "category",
+        "ko_time": "category",
+        "cup_round": "category",
+        "cup_leg": "Int8",
+        "cup_stage": "category",
+        "cup_replay": "Int8",
+        "cup_section": "category",
+        "aet": "Int8",
+        "pen_outcome": "category",
+        "pen_score": "category",
+        "pen_gf": "Int8",
+        "pen_ga": "Int8",
+        "agg_outcome": "category",
+        "agg_score": "category",
+        "agg_gf": "Int8",
+        "agg_ga": "Int8",
+        "away_goal_outcome": "category",
+        "gg_outcome": "category",
+        "decider": "category",
+        "cup_outcome": "category",
+        "outcome_desc": "category",
+        "game_length": "Int16",
+        "stadium": "category",
+        "referee": "category",
+    },
+    "player_apps": {
+        "game_date": "date",
+        "player_name": "category",
+        "shirt_no": "Int16",
+        "role": "category",
+    },
+    "subs": {
+        "game_date": "date",
+        "shirt_no": "Int16",
+        "player_name": "category",
+        "on_for": "Int16",
+        "off_for": "Int16",
+    },
+    "sub_mins": {
+        "game_date": "date",
+        "player_name": "category",
+        "min_off": "Int16",
+        "min_on": "Int16",
+    },
+    "goals": {
+        "game_date": "date",
+        "player_name": "category",
+        "goal_min": "Int16",
+        "penalty": "Int8",
+        "own_goal": "Int8",
+    },
+    "yellow_cards": {
+        "game_date": "date",
+        "player_name": "category",
+        "min_yc": "Int16",
+    },
+    "red_cards": {
+        "game_date": "date",
+        "player_name": "category",
+        "min_so": "Int16",
+    },
+}
+
+
+# Tables where a player can legitimately appear twice in one match (a sub
+# who is later subbed off, a second yellow, two goals) have no unique key;
+# their rows are replaced per match through the game_date index instead.
+SQLITE_KEYS = {
+    "results": ["game_date"],
+    "player_apps": ["game_date", "player_name"],
+    "subs": None,
+    "sub_mins": None,
+    "goals": None,
+    "yellow_cards": None,
+    "red_cards": ["game_date", "player_name"],
+}
+
+SQLITE_INDEXES = ["game_date", "season", "player_name"]
+
+
+def get_schema(df_name, columns):
+    schema = SCHEMAS.get(df_name, {})
+    return {col: schema[col] for col in columns if col in schema}
+
+
+def get_read_dtypes(df_name):
+    schema = SCHEMAS.get(df_name, {})
+    return {col: dtype for col, dtype in schema.items() if dtype != "date"}
+
+
+def get_columns(df_name, df):
+    schema = SCHEMAS.get(df_name, {})
+    columns = [col for col in schema if col in df.columns]
+    return columns + [col for col in df.columns if col not in schema]
+
+
+def needs_cast(col, dtype):
+    if dtype == "date":
+        return col.dtype.kind != "M"
+    return col.dtype != dtype
+
+
+def apply_schema(df_name, df):
+    casts = {
+        col: dtype
+        for col, dtype in get_schema(df_name, df.columns).items()
+        if needs_cast(df[col], dtype)
     }
+    if not casts:
+        return df
+
+    df = df.copy()
+    for col, dtype in casts.items():
+        if dtype == "date":
+            df[col] = pd.to_datetime(df[col], format=DATE_FORMAT)
+            continue
+        if dtype != "category" and df[col].dtype.kind not in "biuf":
+            df[col] = pd.to_numeric(df[col])
+        df[col] = df[col].astype(dtype)
+    return df
+
+
+def serialize_csv(df_name, df, header=True):
+    # One fixed column order, dtype and line ending, so the same rows always
+    # produce the same bytes and unchanged tables can be recognised by hash.
+    df = apply_schema(df_name, df[get_columns(df_name, df)])
+    data = df.to_csv(
+        index=False, header=header, lineterminator="\n", date_format=DATE_FORMAT
+    )
+    return data.encode("utf-8")
+
+
+def append_csv(data, path):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        needs_newline = f.tell() > 0
+        if needs_newline:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+
+    with open(path, "ab") as f:
+        if needs_newline:
+            f.write(b"\n")
+        f.write(data)
+
+
+def get_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_file_hash(path):
+    with open(path, "rb") as f:
+        return get_hash(f.read())
+
+
+def read_json(path, default=None):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return default
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+class content_manifest:
+    def __init__(self, root):
+        self.root = root
+        self.path = f"{root}/manifest.json"
+
+    def get_key(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def get_hash(self, path):
+        # Like git's index: size and mtime unchanged means the stored hash
+        # still holds, so unchanged tables are never read just to hash them.
+        stat = os.stat(path)
+        entry = read_json(self.path, {}).get(self.get_key(path))
+        if entry and [entry["size"], entry["mtime_ns"]] == [
+            stat.st_size,
+            stat.st_mtime_ns,
+        ]:
+            return entry["sha256"]
+        return get_file_hash(path)
+
+    def is_canonical(self, path):
+        # Whether the file was last written whole by serialize_csv; tables
+        # from before that still hold float-formatted integers and the like.
+        entry = read_json(self.path, {}).get(self.get_key(path))
+        if not entry or not entry.get("canonical"):
+            return False
+        return self.get_hash(path) == entry["sha256"]
+
+    def record(self, path, digest=None, canonical=False):
+        stat = os.stat(path)
+        entries = read_json(self.path, {})
+        entries[self.get_key(path)] = {
+            "sha256": digest or get_file_hash(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+        if canonical:
+            entries[self.get_key(path)]["canonical"] = True
+        write_json(self.path, entries)
+
+    def write_file(self, path, data, canonical=False):
+        digest = get_hash(data)
+        if os.path.exists(path) and self.get_hash(path) == digest:
+            if canonical and not self.is_canonical(path):
+                self.record(path, digest, canonical)
+            return False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+        self.record(path, digest, canonical)
+        return True
+
+    def append_file(self, path, data):
+        canonical = self.is_canonical(path)
+        append_csv(data, path)
+        self.record(path, canonical=canonical)
+
+
+class csv_storage:
+    upserts = False
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self.manifest = content_manifest(data_dir)
+
+    def get_path(self, df_name):
+        return f"{self.data_dir}/{df_name}.csv"
+
+    def get_size(self, df_name):
+        return os.path.getsize(self.get_path(df_name))
+
+    def read_bytes(self, df_name):
+        with open(self.get_path(df_name), "rb") as f:
+            return f.read()
+
+    @timed("load_csv")
+    def parse(self, df_name, source, columns=None):
+        return pd.read_csv(
+            source,
+            usecols=columns,
+            dtype=get_read_dtypes(df_name),
+            parse_dates=["game_date"],
+            date_format=DATE_FORMAT,
+            low_memory=False,
+        )
+
+    def load(self, df_name, columns=None):
+        return self.parse(df_name, self.get_path(df_name), columns)
+
+    def load_for_update(self, df_name, updates):
+        return self.load(df_name)
+
+    def get_hash(self, df_name):
+        return self.manifest.get_hash(self.get_path(df_name))
+
+    def get_files(self, df_name, df):
+        return [self.get_path(df_name)]
+
+    def is_canonical(self, df_name, df):
+        # Appending serialized rows to a file in an older format would mix
+        # two formats in one column, so such files are rebuilt first.
+        if list(df.columns) != get_columns(df_name, df):
+            return False
+        return all(
+            self.manifest.is_canonical(path) for path in self.get_files(df_name, df)
+        )
+
+    def transaction(self):
+        return nullcontext()
+
+    @timed("write_csv")
+    def save(self, df_name, df):
+        data = serialize_csv(df_name, df)
+        written = self.manifest.write_file(self.get_path(df_name), data, canonical=True)
+        if not written:
+            print(f"{df_name.upper()} unchanged, not rewritten.")
+        return written
+
+    @timed("write_csv")
+    def append(self, df_name, new_rows, updated_df):
+        data = serialize_csv(df_name, new_rows, header=False)
+        self.manifest.append_file(self.get_path(df_name), data)
+        return True
+
+
+class parquet_storage(csv_storage):
+    def __init__(self, data_dir=DATA_DIR):
+        super().__init__(data_dir)
+        self.columnar_dir = f"{data_dir}/parquet"
+        self.columnar_manifest_path = f"{self.columnar_dir}/manifest.json"
+
+    def get_columnar_path(self, df_name):
+        return f"{self.columnar_dir}/{df_name}"
+
+    def get_part_path(self, df_name, n):
+        return f"{self.get_columnar_path(df_name)}/part-{n:05d}.parquet"
+
+    def list_parts(self, df_name):
+        table_dir = self.get_columnar_path(df_name)
+        if not os.path.isdir(table_dir):
+            return []
+        return [
+            f"{table_dir}/{file_name}"
+            for file_name in sorted(os.listdir(table_dir))
+            if file_name.endswith(".parquet")
+        ]
+
+    def read_manifest(self):
+        return read_json(self.columnar_manifest_path, {})
+
+    def write_manifest(self, manifest):
+        write_json(self.columnar_manifest_path, manifest)
+
+    def is_fresh(self, df_name):
+        manifest = self.read_manifest()
+        return (
+            df_name in manifest
+            and bool(self.list_parts(df_name))
+            and manifest[df_name] == self.manifest.get_hash(self.get_path(df_name))
+        )
+
+    def record_columnar(self, df_name):
+        manifest = self.read_manifest()
+        manifest[df_name] = self.manifest.get_hash(self.get_path(df_name))
+        self.write_manifest(manifest)
+
+    @timed("write_parquet")
+    def write_columnar(self, df_name, df):
+        # Rewrites the copy as a single part, which also compacts the parts
+        # that appends have added since.
+        os.makedirs(self.get_columnar_path(df_name), exist_ok=True)
+        tmp_path = f"{self.get_part_path(df_name, 0)}.tmp"
+        try:
+            df.to_parquet(tmp_path, index=False)
+        except (TypeError, ValueError):
+            # Rows merged in memory can hold mixed Python types that Arrow
+            # rejects; the CSV just written always reads back cleanly.
+            super().load(df_name).to_parquet(tmp_path, index=False)
+
+        for part_path in self.list_parts(df_name):
+            os.remove(part_path)
+        os.replace(tmp_path, self.get_part_path(df_name, 0))
+        legacy_path = f"{self.columnar_dir}/{df_name}.parquet"
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+        self.record_columnar(df_name)
+
+    @timed("write_parquet")
+    def append_columnar(self, df_name, new_rows):
+        parts = self.list_parts(df_name)
+        n = int(os.path.basename(parts[-1])[5:10]) + 1
+        part_path = self.get_part_path(df_name, n)
+        new_rows.to_parquet(f"{part_path}.tmp", index=False)
+        os.replace(f"{part_path}.tmp", part_path)
+        self.record_columnar(df_name)
+
+    @timed("load_parquet")
+    def read_columnar(self, df_name, columns=None):
+        df = pd.concat(
+            [
+                pd.read_parquet(path, columns=columns)
+                for path in self.list_parts(df_name)
+            ],
+            ignore_index=True,
+        )
+        return apply_schema(df_name, df)
+
+    def load(self, df_name, columns=None):
+        if self.is_fresh(df_name):
+            return self.read_columnar(df_name, columns)
+
+        df = super().load(df_name)
+        self.write_columnar(df_name, df)
+        if columns:
+            df = df[columns]
+        return df
+
+    def save(self, df_name, df):
+        written = super().save(df_name, df)
+        if written or not self.is_fresh(df_name):
+            self.write_columnar(df_name, df)
+        return written
+
+    def append(self, df_name, new_rows, updated_df):
+        # Appends only add a part holding the new rows, so their cost follows
+        # the size of the update; the parts are compacted back into one
+        # every COLUMNAR_MAX_PARTS appends.
+        was_fresh = self.is_fresh(df_name)
+        super().append(df_name, new_rows, updated_df)
+        if not was_fresh or len(self.list_parts(df_name)) >= COLUMNAR_MAX_PARTS:
+            self.write_columnar(df_name, updated_df)
+            return True
+        try:
+            self.append_columnar(df_name, new_rows)
+        except (TypeError, ValueError):
+            self.write_columnar(df_name, updated_df)
+        return True
+
+
+def get_partitions(seasons):
+    return pd.Series(seasons).astype(str).str.replace("/", "-")
 
+
+class partitioned_storage(csv_storage):
+    def __init__(self, data_dir=DATA_DIR):
+        super().__init__(data_dir)
+        self.season_index = (None, None)
+
+    def get_dir(self, df_name):
+        return f"{self.data_dir}/{df_name}"
+
+    def get_partition_path(self, df_name, partition):
+        return f"{self.get_dir(df_name)}/{partition}.csv"
+
+    def list_partitions(self, df_name):
+        return sorted(
+            file_name.removesuffix(".csv")
+            for file_name in os.listdir(self.get_dir(df_name))
+            if file_name.endswith(".csv")
+        )
+
+    def get_size(self, df_name):
+        return sum(
+            os.path.getsize(self.get_partition_path(df_name, partition))
+            for partition in self.list_partitions(df_name)
+        )
+
+    def get_hash(self, df_name):
+        hashes = [
+            self.manifest.get_hash(self.get_partition_path(df_name, partition))
+            for partition in self.list_partitions(df_name)
+        ]
+        return get_hash("\n".join(hashes).encode("utf-8"))
+
+    def read_bytes(self, df_name, partitions=None):
+        # Every partition repeats the header; the assembled bytes are a
+        # single CSV, in season order rather than the flat file's row order.
+        header, bodies = None, []
+        for partition in self.list_partitions(df_name):
+            if header is not None and partitions is not None:
+                if partition not in partitions:
+                    continue
+            with open(self.get_partition_path(df_name, partition), "rb") as f:
+                first_line, _, body = f.read().partition(b"\n")
+            header = header or first_line
+            if partitions is None or partition in partitions:
+                body = body.rstrip(b"\n")
+                if body:
+                    bodies.append(body)
+        return b"\n".join([header] + bodies) + b"\n"
+
+    def load(self, df_name, columns=None, partitions=None):
+        data = self.read_bytes(df_name, partitions)
+        return self.parse(df_name, io.BytesIO(data), columns)
+
+    def get_files(self, df_name, df):
+        # Only the partitions an update loaded are appended to or rebuilt.
+        return [
+            self.get_partition_path(df_name, partition)
+            for partition in set(self.get_partitions(df))
+        ]
+
+    def get_seasons(self, game_dates):
+        # Event tables have no season column, so each match takes the season
+        # RESULTS gave it; the calendar only covers matches not stored yet.
+        game_dates = pd.to_datetime(pd.Series(game_dates))
+        results_hash = None
+        if os.path.isdir(self.get_dir("results")):
+            results_hash = self.get_hash("results")
+        if self.season_index[0] != results_hash:
+            seasons = pd.Series(dtype=str)
+            if results_hash is not None:
+                results = self.load("results", columns=["game_date", "season"])
+                results = results.drop_duplicates("game_date")
+                seasons = results.set_index("game_date").season.astype(str)
+            self.season_index = (results_hash, seasons)
+        seasons = game_dates.map(self.season_index[1])
+        return seasons.where(
+            seasons.notna(), game_dates.dt.strftime(DATE_FORMAT).map(get_season)
+        )
+
+    def get_partitions(self, df):
+        if "season" in df:
+            return get_partitions(df.season).values
+        return get_partitions(self.get_seasons(df.game_date)).values
+
+    def load_for_update(self, df_name, updates):
+        # Season numbering restarts every season, so the seasons being
+        # updated are all an update needs to see or rewrite.
+        partitions = set(self.get_partitions(updates))
+        return self.load(df_name, partitions=partitions)
+
+    def write_partition(self, df_name, partition, df):
+        path = self.get_partition_path(df_name, partition)
+        return self.manifest.write_file(
+            path, serialize_csv(df_name, df), canonical=True
+        )
+
+    @timed("write_csv")
+    def save(self, df_name, df):
+        partitions = self.get_partitions(df)
+        written = [
+            self.write_partition(df_name, partition, rows)
+            for partition, rows in df.groupby(partitions, sort=True)
+        ]
+        print(
+            f"{sum(written)} of {len(written)} {df_name.upper()} partition(s) rewritten."
+        )
+        return any(written)
+
+    def repartition(self, df_name):
+        # Tables split before partitions followed the season column had
+        # matches filed by calendar date; rows are moved to their season.
+        old_partitions = set(self.list_partitions(df_name))
+        df = self.load(df_name)
+        self.save(df_name, df)
+        for partition in old_partitions - set(self.get_partitions(df)):
+            os.remove(self.get_partition_path(df_name, partition))
+
+    @timed("write_csv")
+    def append(self, df_name, new_rows, updated_df):
+        partitions = self.get_partitions(new_rows)
+        for partition, rows in new_rows.groupby(partitions, sort=True):
+            path = self.get_partition_path(df_name, partition)
+            if os.path.exists(path):
+                data = serialize_csv(df_name, rows, header=False)
+                self.manifest.append_file(path, data)
+            else:
+                self.write_partition(df_name, partition, rows)
+        return True
+
+
+def get_sqlite_type(dtype):
+    return "TEXT" if dtype in ["date", "category"] else "INTEGER"
+
+
+class sqlite_storage:
+    upserts = True
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self.path = f"{data_dir}/{DB_NAME}"
+
+    @cached_property
+    def conn(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS table_versions "
+            "(table_name TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        for df_name in TABLES:
+            self.create_table(conn, df_name)
+        return conn
+
+    def get_table_sql(self, df_name):
+        schema = SCHEMAS[df_name]
+        columns = [f"{col} {get_sqlite_type(dtype)}" for col, dtype in schema.items()]
+        keys = SQLITE_KEYS[df_name]
+        if keys:
+            columns.append(f"PRIMARY KEY ({', '.join(keys)})")
+        return f"CREATE TABLE {df_name} ({', '.join(columns)})"
+
+    def create_table(self, conn, df_name):
+        schema = SCHEMAS[df_name]
+        keys = SQLITE_KEYS[df_name]
+        sql = self.get_table_sql(df_name)
+        row = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+            [df_name],
+        ).fetchone()
+        if row is None:
+            conn.execute(sql)
+        elif row[0] != sql:
+            # Keys have changed since the table was created: copy the rows
+            # into a table built from the current definition, in order.
+            print(f"Rebuilding {df_name.upper()} in {self.path} with its new keys.")
+            conn.execute("BEGIN")
+            conn.execute(f"ALTER TABLE {df_name} RENAME TO {df_name}_old")
+            conn.execute(sql)
+            conn.execute(
+                f"INSERT INTO {df_name} SELECT * FROM {df_name}_old ORDER BY rowid"
+            )
+            conn.execute(f"DROP TABLE {df_name}_old")
+            conn.execute("COMMIT")
+
+        for col in SQLITE_INDEXES:
+            if col in schema and not (keys and keys[0] == col):
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {df_name}_{col} ON {df_name} ({col})"
+                )
+
+    @contextmanager
+    def transaction(self):
+        if self.conn.in_transaction:
+            yield
+            return
+        self.conn.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def get_size(self, df_name):
+        return os.path.getsize(self.path)
+
+    def get_hash(self, df_name):
+        # Bumped in the same transaction as every write, so it identifies the
+        # table contents without exporting the table to hash it.
+        row = self.conn.execute(
+            "SELECT version FROM table_versions WHERE table_name = ?", [df_name]
+        ).fetchone()
+        return f"{DB_NAME}:{df_name}:{row[0] if row else 0}"
+
+    @timed("load_sqlite")
+    def query(self, df_name, where="", params=(), columns=None):
+        cols = ", ".join(columns) if columns else "*"
+        df = pd.read_sql_query(
+            f"SELECT {cols} FROM {df_name} {where} ORDER BY game_date, rowid",
+            self.conn,
+            params=list(params),
+        )
+        return apply_schema(df_name, df)
+
+    def load(self, df_name, columns=None):
+        return self.query(df_name, columns=columns)
+
+    def load_for_update(self, df_name, updates):
+        # Only the matches being updated plus the latest one (the latest
+        # season for results, which numbers games by season) are read, so
+        # both the dedupe and the append check are index lookups.
+        if df_name == "results":
+            col, values = "season", updates.season.astype(str).unique()
+        else:
+            col, values = "game_date", updates.game_date.dt.strftime(DATE_FORMAT)
+        values = sorted(set(values))
+        placeholders = ", ".join("?" * len(values))
+        where = (
+            f"WHERE {col} IN ({placeholders}) OR {col} = "
+            f"(SELECT {col} FROM {df_name} ORDER BY game_date DESC LIMIT 1)"
+        )
+        return self.query(df_name, where, values)
+
+    def read_bytes(self, df_name):
+        return serialize_csv(df_name, self.load(df_name))
+
+    def is_canonical(self, df_name, df):
+        return True
+
+    def upsert(self, df_name, df):
+        columns = list(SCHEMAS[df_name])
+        df = apply_schema(df_name, df.reindex(columns=columns))
+        df["game_date"] = df.game_date.dt.strftime(DATE_FORMAT)
+        dates = sorted(set(df.game_date))
+        rows = df.astype(object).where(df.notna(), None)
+
+        with self.transaction():
+            self.conn.executemany(
+                f"DELETE FROM {df_name} WHERE game_date = ?", [[d] for d in dates]
+            )
+            self.conn.executemany(
+                f"INSERT INTO {df_name} ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                rows.itertuples(index=False, name=None),
+            )
+            self.bump_version(df_name)
+        print(f"{len(dates)} {df_name.upper()} match(es) upserted.")
+        return True
+
+    def bump_version(self, df_name):
+        self.conn.execute(
+            "INSERT INTO table_versions VALUES (?, 1) ON CONFLICT (table_name) "
+            "DO UPDATE SET version = version + 1",
+            [df_name],
+        )
+
+    def count_matches(self, df_name, dates):
+        placeholders = ", ".join("?" * len(dates))
+        row = self.conn.execute(
+            f"SELECT COUNT(*) FROM {df_name} WHERE game_date IN ({placeholders})",
+            list(dates),
+        ).fetchone()
+        return row[0]
+
+    @timed("write_sqlite")
+    def delete_matches(self, df_name, dates):
+        with self.transaction():
+            n_deleted = self.conn.executemany(
+                f"DELETE FROM {df_name} WHERE game_date = ?", [[d] for d in dates]
+            ).rowcount
+            if n_deleted:
+                self.bump_version(df_name)
+        return n_deleted
+
+    @timed("write_sqlite")
+    def save(self, df_name, df):
+        return self.upsert(df_name, df)
+
+    @timed("write_sqlite")
+    def append(self, df_name, new_rows, updated_df):
+        return self.upsert(df_name, new_rows)
+
+
+def get_storage():
+    if STORAGE == "sqlite":
+        return sqlite_storage()
+    if STORAGE is None and os.path.exists(f"{DATA_DIR}/{DB_NAME}"):
+        return sqlite_storage()
+    if STORAGE == "partitioned":
+        return partitioned_storage()
+    if STORAGE is None and os.path.isdir(f"{DATA_DIR}/results"):
+        return partitioned_storage()
+    if STORAGE != "csv" and importlib.util.find_spec("pyarrow"):
+        return parquet_storage()
+    return csv_storage()
+
+
+storage = get_storage()
+
+
+def migrate_storage(data_dir=DATA_DIR, target="partitioned"):
+    if target == "sqlite":
+        return migrate_to_sqlite(data_dir)
+
+    flat = csv_storage(data_dir)
+    partitioned = partitioned_storage(data_dir)
+    for df_name in TABLES:
+        if os.path.isdir(partitioned.get_dir(df_name)):
+            partitioned.repartition(df_name)
+            continue
+        if not os.path.exists(flat.get_path(df_name)):
+            continue
+        df = flat.load(df_name)
+        partitioned.save(df_name, df)
+        pd.testing.assert_frame_equal(partitioned.load(df_name), df)
+        os.remove(flat.get_path(df_name))
+        n_partitions = len(partitioned.list_partitions(df_name))
+        print(f"{df_name.upper()} split into {n_partitions} season partitions.")
+
+
+def migrate_to_sqlite(data_dir=DATA_DIR):
+    flat = csv_storage(data_dir)
+    partitioned = partitioned_storage(data_dir)
+    db = sqlite_storage(data_dir)
+    for df_name in TABLES:
+        if os.path.isdir(partitioned.get_dir(df_name)):
+            source = partitioned
+            source_paths = [
+                partitioned.get_partition_path(df_name, partition)
+                for partition in partitioned.list_partitions(df_name)
+            ]
+        elif os.path.exists(flat.get_path(df_name)):
+            source, source_paths = flat, [flat.get_path(df_name)]
+        else:
+            continue
+
+        df = source.load(df_name)
+        df = df.sort_values(SORT_COLS[df_name], kind="mergesort").reset_index(drop=True)
+        with db.transaction():
+            db.save(df_name, df)
+        pd.testing.assert_frame_equal(db.load(df_name), apply_schema(df_name, df))
+        for path in source_paths:
+            os.remove(path)
+        if source is partitioned:
+            os.rmdir(partitioned.get_dir(df_name))
+        print(f"{df_name.upper()} moved into {db.path} ({len(df)} rows).")
+
+
+def export_tables(output_dir=EXPORT_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+    for df_name in TABLES:
+        path = f"{output_dir}/{df_name}.csv"
+        with open(path, "wb") as f:
+            f.write(storage.read_bytes(df_name))
+        print(f"{df_name.upper()} exported to {path}.")
+
+
+def can_append(df_name, old_df, updates):
+    if old_df.empty or not set(updates.columns) <= set(old_df.columns):
+        return False
+    if not storage.is_canonical(df_name, old_df):
+        return False
+    return updates.game_date.min() > old_df.game_date.max()
+
+
+def number_new_results(old_df, updates):
+    updates = updates.copy()
+    season_counts = old_df.groupby("season", observed=True).size()
+    comp_counts = old_df.groupby(["season", "competition"], observed=True).size()
+
+    prior_games = updates.season.map(season_counts).fillna(0).astype(int)
+    prior_comp_games = pd.Series(
+        [comp_counts.get(key, 0) for key in zip(updates.season, updates.competition)],
+        index=updates.index,
+    )
+
+    updates["game_no"] = (
+        updates.groupby("season", observed=True).cumcount() + 1 + prior_games
+    )
+    updates["ssn_comp_game_no"] = (
+        updates.groupby(["season", "competition"], observed=True).cumcount()
+        + 1
+        + prior_comp_games
+    )
+    updates["weekday"] = updates.game_date.dt.day_name()
+    return updates
+
+
+def append_updates(df_name, old_df, updates):
+    updates = updates.sort_values(SORT_COLS[df_name], kind="mergesort").reset_index(
+        drop=True
+    )
+    if df_name == "results":
+        updates = number_new_results(old_df, updates)
+
+    new_rows = apply_schema(df_name, updates.reindex(columns=old_df.columns))
+    updated_df = apply_schema(df_name, pd.concat([old_df, new_rows], ignore_index=True))
+
+    storage.append(df_name, new_rows, updated_df)
+    report.add_table(df_name, mode="append", rows_written=len(new_rows))
+    print(f"{len(new_rows)} rows appended to {df_name.upper()}.")
+    return updated_df
+
+
+@timed("update_csv")
+def update_csv(df_name, old_df, updates):
     updates["game_date"] = pd.to_datetime(updates.game_date)
 
+    if can_append(df_name, old_df, updates):
+        return append_updates(df_name, old_df, updates)
+
+    if storage.is_canonical(df_name, old_df):
+        print(f"Out-of-order updates for {df_name.upper()}, rebuilding the full table.")
+    else:
+        print(
+            f"{df_name.upper()} is in an older CSV format, rebuilding the full table."
+        )
+
     updated_df = (
         pd.concat([old_df, updates])
-        .sort_values(by="game_date", ascending=False)
+        .sort_values(by="game_date", ascending=False, kind="mergesort")
         .reset_index(drop=True)
     )
     if df_name == "results":
         updated_df["game_no"] = (
-            updated_df.sort_values(by="game_date").groupby(["season"]).cumcount() + 1
+            updated_df.sort_values(by="game_date", kind="mergesort")
+            .groupby(["season"], observed=True)
+            .cumcount()
+            + 1
         )
         updated_df["ssn_comp_game_no"] = (
-            updated_df.sort_values(by=["game_date"])
-            .groupby(["season", "competition"])
+            updated_df.sort_values(by=["game_date"], kind="mergesort")
+            .groupby(["season", "competition"], observed=True)
             .cumcount()
             + 1
         )
@@ -896,31 +2824,66 @@ def update_csv(df_name, old_df, updates):
 
         updated_df.loc[updated_df.game_date == "2023-08-19", "attendance"] = 5594
 
-    updated_df = updated_df.sort_values(sort_cols[df_name]).reset_index(drop=True)
+    updated_df = updated_df.sort_values(
+        SORT_COLS[df_name], kind="mergesort"
+    ).reset_index(drop=True)
+    updated_df = apply_schema(df_name, updated_df)
 
-    updated_df.to_csv(f"./data/{df_name}.csv", index=False)
+    storage.save(df_name, updated_df)
+    report.add_table(df_name, mode="rebuild", rows_written=len(updated_df))
     return updated_df
 
 
-def update_df(df_name, updates):
-    print(f"\nUpdating {df_name.upper()} dataframe...")
+def drop_stale_matches(df_name, updates, refreshed, timestamp=None):
+    # A refetched match with no rows for this table any more (a rescinded
+    # card, say) would otherwise keep the rows stored before the refresh.
+    fetched = set()
+    if updates is not None and not updates.empty:
+        fetched = set(pd.to_datetime(updates.game_date).dt.strftime(DATE_FORMAT))
+    stale = sorted(set(refreshed) - fetched)
+    if not stale or not storage.count_matches(df_name, stale):
+        return
 
-    old_df = pd.read_csv(f"./data/{df_name}.csv", parse_dates=["game_date"])
+    if not fetched:
+        archive_csv(df_name, timestamp)
+    n_deleted = storage.delete_matches(df_name, stale)
+    print(f"{n_deleted} stale rows removed from {df_name.upper()}.")
+    report.add_table(df_name, rows_deleted=n_deleted)
+
+
+@timed("update_df")
+def update_df(df_name, updates, timestamp=None, refreshed=()):
+    print(f"\nUpdating {df_name.upper()} dataframe...")
+    if refreshed:
+        drop_stale_matches(df_name, updates, refreshed, timestamp)
 
     if updates is None or updates.empty:
         print(f"No updates required for {df_name.upper()}.")
     else:
         print(f"{len(updates)} possible updates found...")
 
-        updates = updates[~updates.game_date.isin(old_df.game_date)]
+        old_df = storage.load_for_update(df_name, updates)
+
+        if storage.upserts:
+            # Writes replace every stored row of a match, so refetched
+            # matches are dropped from the loaded rows rather than the updates.
+            old_df = old_df[~old_df.game_date.isin(updates.game_date)]
+        else:
+            updates = updates[~updates.game_date.isin(old_df.game_date)]
 
         n_updates = len(updates)
 
         print(f"{n_updates} updates being made to {df_name.upper()}.")
 
         if n_updates > 0:
-            archive_csv(df_name, old_df)
+            archive_csv(df_name, timestamp)
             updated_df = update_csv(df_name, old_df, updates)
+            report.add_table(
+                df_name,
+                rows_added=n_updates,
+                rows_total=len(updated_df),
+                bytes=storage.get_size(df_name),
+            )
             return updated_df
 
 
@@ -930,36 +2893,429 @@ def print_msg(date):
     print(f"\n{border}\n* {msg} *\n{border}\n")
 
 
-def main(table_source, date_req=None):
-    dates = check_dates(date_req)
+@timed("match_records")
+def get_match_records(date, table_source, match_list=None, manager=None):
+    print_msg(date)
+
+    match_data = bbc_api(date, match_list=match_list)
+    records = {"results": get_match_df(date, table_source, match_data, manager)}
+
+    events = events_df(date, match_data)
+    for df_name in EVENT_TABLES:
+        records[df_name] = getattr(events, df_name)
+    return records
+
+
+def backfill(dates, table_source, max_workers=MAX_WORKERS, match_lists=None):
+    records = []
+    if not dates:
+        return records
+
+    managers = dict(zip(dates, get_managers(dates)))
+
+    if match_lists is None:
+        match_lists = {}
+        if len(dates) > 1:
+            try:
+                match_lists = get_match_lists_for(dates)
+            except Exception as e:
+                print(
+                    f"Could not fetch match lists by range ({e!r}), fetching per date."
+                )
+
+    n_workers = max(1, min(max_workers, len(dates)))
+    print(f"Fetching {len(dates)} match(es) using {n_workers} worker(s)...")
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {
+            executor.submit(
+                get_match_records,
+                date,
+                table_source,
+                match_lists.get(date),
+                managers[date],
+            ): date
+            for date in dates
+        }
+        for future in as_completed(futures):
+            date = futures[future]
+            try:
+                records.append(future.result())
+            except match_not_found:
+                print(f"No match found for {date}.")
+            except Exception as e:
+                print(f"Failed to get match records for {date}: {e!r}")
+    return records
+
+
+class staged_updates:
+    def __init__(self, refresh_dates=()):
+        self.timestamp = get_timestamp()
+        self.pending = {df_name: [] for df_name in TABLES}
+        self.refresh_dates = set(refresh_dates)
+        self.fetched = set()
+
+    def add(self, df_name, updates):
+        if updates is not None and not updates.empty:
+            self.pending[df_name].append(updates)
+
+    def add_records(self, records):
+        game_dates = pd.to_datetime(records["results"].game_date)
+        self.fetched.update(game_dates.dt.strftime(DATE_FORMAT))
+        for df_name, updates in records.items():
+            self.add(df_name, updates)
+
+    def get_updates(self, df_name):
+        if self.pending[df_name]:
+            return pd.concat(self.pending[df_name], ignore_index=True)
+
+    def commit(self):
+        # Only matches that were actually refetched are replaced; a failed
+        # fetch leaves the stored rows alone.
+        refreshed = sorted(self.refresh_dates & self.fetched)
+        updated = {}
+        with storage.transaction():
+            for df_name in TABLES:
+                updates = self.get_updates(df_name)
+                updated[df_name] = update_df(
+                    df_name, updates, self.timestamp, refreshed
+                )
+        return updated
+
+
+def main(table_source, date_req=None, max_workers=MAX_WORKERS, refresh=False):
+    memo.clear()
+    report.clear()
     existing_dates = get_existing_dates()
+    dates = check_dates(date_req, existing_dates=set() if refresh else existing_dates)
 
+    new_dates = []
     if dates:
-        for date in dates:
-            if date in existing_dates:
+        for date in map(normalize_date, dates):
+            if date in existing_dates and not refresh:
                 print(f"Already have record for {date}.")
             else:
-                print_msg(date)
+                new_dates.append(date)
+
+        n_skipped = len(dates) - len(new_dates)
+        print(f"{n_skipped} date(s) already in RESULTS skipped without fetching.")
+
+        refresh_dates = [date for date in new_dates if date in existing_dates]
+        if refresh_dates:
+            print(f"{len(refresh_dates)} stored match(es) being refetched.")
+
+        staged = staged_updates(refresh_dates)
+        match_lists = None
+        if is_date_range(date_req):
+            match_lists = get_range_match_lists(date_req)
+        for records in backfill(new_dates, table_source, max_workers, match_lists):
+            staged.add_records(records)
+        print(f"\n{memo.saved} repeat fetches avoided by reusing loaded data.")
+        staged.commit()
+
+    report.write(
+        table_source=table_source,
+        date_req=date_req,
+        dates=new_dates,
+        memo_saved=memo.saved,
+    )
+    print(f"Run report appended to {REPORT_PATH}.")
+
+
+class match_scheduler:
+    def __init__(
+        self,
+        table_source,
+        client=None,
+        calendar=None,
+        poll_interval=POLL_INTERVAL,
+        max_interval=POLL_MAX_INTERVAL,
+        poll_timeout=POLL_TIMEOUT,
+        max_sleep=SCHEDULER_MAX_SLEEP,
+    ):
+        self.table_source = table_source
+        self.client = client if client is not None else default_client
+        self.calendar = calendar if calendar is not None else fixture_calendar()
+        self.poll_interval = poll_interval
+        self.max_interval = max_interval
+        self.poll_timeout = pd.Timedelta(seconds=poll_timeout)
+        self.max_sleep = max_sleep
+        self.skipped = set()
+
+    def now(self):
+        return pd.Timestamp.now(tz="Europe/London")
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def get_next_fixture(self):
+        since = self.now() - self.poll_timeout
+        existing_dates = get_existing_dates() | self.skipped
+        unplayed = self.calendar.get_unplayed(existing_dates, since)
+        if not unplayed.empty:
+            return unplayed.index[0], unplayed.end_time.iloc[0]
+
+    def get_progress(self, date):
+        r = self.client.get(get_match_list_url(date, date), ttl=0)
+        if r.status_code != 200:
+            return None
+        match_list = r.json()
+        if not match_list["matchData"]:
+            return None
+        match_data = bbc_api(date, self.client, match_list).match_data
+        return match_data["eventStatus"], match_data["eventProgress"]
+
+    def is_complete(self, progress):
+        if progress is None:
+            return False
+        status, event_progress = progress
+        return status == "post-event" or event_progress in MATCH_COMPLETE
+
+    def poll(self, date, end_time):
+        deadline = end_time + self.poll_timeout
+        interval = self.poll_interval
+        while self.now() < deadline:
+            try:
+                progress = self.get_progress(date)
+            except (requests.RequestException, match_data_error) as e:
+                progress = None
+                print(f"Could not check progress for {date} ({e!r}).")
+
+            if self.is_complete(progress):
+                print(f"Game on {date} is complete ({progress[1]}).")
+                return True
+
+            print(f"Game on {date} not finished ({progress}), checking in {interval}s.")
+            self.sleep(interval)
+            interval = min(interval * 2, self.max_interval)
+        return False
+
+    def run_once(self):
+        self.calendar.ensure_fresh(self.client)
+        fixture = self.get_next_fixture()
+        if fixture is None:
+            print(f"No upcoming games, checking again in {self.max_sleep}s.")
+            self.sleep(self.max_sleep)
+            return
+
+        date, end_time = fixture
+        wait = (end_time - self.now()).total_seconds()
+        if wait > 0:
+            print(f"Next game on {date}, sleeping until {end_time:%Y-%m-%d %H:%M}.")
+            self.sleep(min(wait, self.max_sleep))
+            return
+
+        if self.poll(date, end_time):
+            main(self.table_source, date)
+        else:
+            print(f"Gave up waiting for the game on {date} to finish.")
+        if date not in get_existing_dates():
+            self.skipped.add(date)
+
+    def run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Scheduler error ({e!r}), retrying in {self.max_interval}s.")
+                self.sleep(self.max_interval)
 
-                match_data = bbc_api(date)
 
-                res_updates = get_match_df(date, table_source, match_data)
+def schedule(table_source):
+    match_scheduler(table_source).run()
 
-                update_df("results", res_updates)
 
-                events = events_df(date, match_data)
+def parse_time(value):
+    return datetime.fromisoformat(value) if value else None
 
-                dfs = [
-                    "player_apps",
-                    "subs",
-                    "sub_mins",
-                    "goals",
-                    "yellow_cards",
-                    "red_cards",
-                ]
-                for df in dfs:
-                    updates = getattr(events, df)
-                    update_df(df, updates)
+
+def read_calendar_rows(path=CALENDAR_PATH):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def get_result_paths(data_dir=DATA_DIR):
+    partition_dir = f"{data_dir}/results"
+    if os.path.isdir(partition_dir):
+        return [
+            f"{partition_dir}/{file_name}"
+            for file_name in sorted(os.listdir(partition_dir))
+            if file_name.endswith(".csv")
+        ]
+    return [f"{data_dir}/results.csv"]
+
+
+def read_result_dates(data_dir=DATA_DIR):
+    db_path = f"{data_dir}/{DB_NAME}"
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            return {row[0] for row in conn.execute("SELECT game_date FROM results")}
+        finally:
+            conn.close()
+
+    dates = set()
+    for path in get_result_paths(data_dir):
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            col = next(reader).index("game_date")
+            dates.update(row[col][:10] for row in reader)
+    return dates
+
+
+def get_calendar_age(now, state_path=CALENDAR_STATE_PATH):
+    scraped_at = read_json(state_path, {}).get("scraped_at")
+    if scraped_at:
+        return (now - parse_time(scraped_at)).total_seconds()
+
+
+def check_today_quick(now=None):
+    # Answers the common "nothing to do" cases from the stored calendar with
+    # the standard library only; None means the full check is needed.
+    if not os.path.exists(CALENDAR_PATH):
+        return None
+    now = now if now is not None else datetime.now(UK_TZ)
+    age = get_calendar_age(now)
+    if age is None or age > CALENDAR_MAX_AGE:
+        return None
+    rows = read_calendar_rows()
+
+    date = now.strftime("%Y-%m-%d")
+    games = sorted(
+        (row for row in rows if row["game_date"][:10] == date),
+        key=lambda row: row["date_time"],
+    )
+    if not games:
+        return "No game today."
+    if parse_time(games[0]["end_time"]) >= now:
+        return f"There is a game today against {games[0]['opposition']}, but it is not ready for update. Please try again later."
+    if date in read_result_dates():
+        return f"Already have record for {date}."
+    return None
+
+
+def print_status(now=None):
+    now = now if now is not None else datetime.now(UK_TZ)
+    result_dates = read_result_dates()
+    print(f"Latest result: {max(result_dates)} ({len(result_dates)} games)")
+
+    if not os.path.exists(CALENDAR_PATH):
+        print("No fixture calendar stored yet.")
+        return
+    rows = read_calendar_rows()
+
+    age = get_calendar_age(now)
+    if age is None:
+        print("Fixture calendar has never been scraped.")
+    else:
+        state = "stale" if age > CALENDAR_MAX_AGE else "fresh"
+        print(f"Fixture calendar scraped {age / 3600:.1f}h ago ({state}).")
+
+    missing = sorted(
+        {
+            row["game_date"][:10]
+            for row in rows
+            if parse_time(row["end_time"]) < now
+            and row["game_date"][:10] not in result_dates
+        }
+    )
+    print(f"{len(missing)} played game(s) missing from RESULTS.")
+    for date in missing:
+        print(f"  {date}")
+
+    upcoming = sorted(
+        (row for row in rows if parse_time(row["end_time"]) >= now),
+        key=lambda row: row["date_time"],
+    )
+    if upcoming:
+        game = upcoming[0]
+        print(
+            f"Next game: {game['opposition']} ({game['venue']}, {game['competition']}) "
+            f"kicking off {parse_time(game['date_time']):%Y-%m-%d %H:%M}"
+        )
+    else:
+        print("No upcoming games in the calendar.")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Update the Tranmere Rovers results and match event data."
+    )
+    parser.add_argument("--table-source", choices=["bbc", "11v11"], default="bbc")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    commands = parser.add_subparsers(dest="command")
+
+    update = commands.add_parser("update", help="add today's game if it has finished")
+    update.add_argument("date", nargs="?", help="YYYY-MM-DD, defaults to today")
+    update.add_argument(
+        "--refresh",
+        action="store_true",
+        help="refetch the game even if stored, replacing its rows (SQLite only)",
+    )
+
+    backfill = commands.add_parser("backfill", help="add games missing from results")
+    backfill.add_argument("dates", help="START..END, or 'played' for all played games")
+    backfill.add_argument(
+        "--refresh",
+        action="store_true",
+        help="refetch stored games in the range too, replacing their rows (SQLite only)",
+    )
+
+    commands.add_parser("status", help="summarise stored results and fixtures")
+    commands.add_parser("schedule", help="run until each game finishes, then update")
+
+    export = commands.add_parser("export", help="write each table as one flat CSV")
+    export.add_argument("--output", default=EXPORT_DIR)
+
+    migrate = commands.add_parser(
+        "migrate-storage", help="move the CSVs in data/ into another storage layout"
+    )
+    migrate.add_argument(
+        "--to",
+        choices=["partitioned", "sqlite"],
+        default="partitioned",
+        help="season partitions, or one SQLite database keyed by match",
+    )
+    commands.add_parser(
+        "migrate-archive",
+        help="move CSV snapshots in archive/ into the content-addressed store",
+    )
+
+    parser.set_defaults(command="update", date=None, refresh=False)
+    return parser
+
+
+def cli(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    if args.refresh and not storage.upserts:
+        parser.error(
+            "--refresh needs the SQLite storage, see migrate-storage --to sqlite"
+        )
+
+    if args.command == "status":
+        print_status()
+    elif args.command == "schedule":
+        schedule(args.table_source)
+    elif args.command == "export":
+        export_tables(args.output)
+    elif args.command == "migrate-storage":
+        migrate_storage(target=args.to)
+    elif args.command == "migrate-archive":
+        migrate_archive()
+    elif args.command == "backfill":
+        if not is_date_range(args.dates) and args.dates not in ["played", "all"]:
+            parser.error("backfill expects START..END or 'played'")
+        main(args.table_source, args.dates, args.workers, args.refresh)
+    else:
+        quick = args.date is None and not args.refresh
+        message = check_today_quick() if quick else None
+        if message:
+            print(message)
+        else:
+            main(args.table_source, args.date, args.workers, args.refresh)
 
 
-main(table_source="bbc")
\ No newline at end of file
+if __name__ == "__main__":
+    cli()